@@ -5,6 +5,7 @@ from libs.config import *
 class ConfigDefinition:
     class General:
         log_directory = PathField(default='logs')
+        copy_strategy = TextField(default='reflink', allowed=['reflink', 'hardlink', 'copy_file_range', 'sendfile', 'copy'], lower=True, comment='How files that are not extracted are copied to the output folder. Unsupported strategies fall back to the next ones:\nhardlink > reflink > copy_file_range > sendfile > copy\nexcept for hashed files, where hardlink and reflink fall back to copy, which hashes and copies them in a single read\nhardlink shares the inode with the source file: any change to the output changes the evidence')
 
     class Bin:
         tar = TextField(default='/usr/bin/tar')
@@ -12,6 +13,21 @@ class ConfigDefinition:
         unzip = TextField(default='/usr/bin/unzip')
         sevenz = TextField(default='/usr/bin/7z')
         gzip = TextField(default='/usr/bin/gzip')
+        pigz = TextField(required=False, comment='Optional decompression tools, looked up in PATH if not set. The fastest installed one is used for each format:\ngz: pigz > gzip, bz2: lbzip2 > pbzip2 > bzip2, xz: xz -T0, zst: zstd -T0')
+        lbzip2 = TextField(required=False)
+        pbzip2 = TextField(required=False)
+        bzip2 = TextField(required=False)
+        xz = TextField(required=False)
+
+    class Backend:
+        __comment__ = 'Extraction backend for each format: native (python standard library, in-process), system (external binary from the bin section)\nor auto (the fastest installed multithreaded decompression tool, else native)\nThe external binary is also used if the native backend can not handle a given file'
+        gz = TextField(default='auto', allowed=['auto', 'native', 'system'], lower=True)
+        bz2 = TextField(default='auto', allowed=['auto', 'native', 'system'], lower=True)
+        xz = TextField(default='auto', allowed=['auto', 'native', 'system'], lower=True)
+        tgz = TextField(default='auto', allowed=['auto', 'native', 'system'], lower=True)
+        tar = TextField(default='native', allowed=['native', 'system'], lower=True)
+        zip = TextField(default='native', allowed=['native', 'system'], lower=True)
+        stream_tar = BooleanField(default=True, comment='Unpack a tar found inside a gz, xz or zst stream straight to the output directory, without writing the intermediate tar file')
   
 CONFIG = Config(ConfigDefinition)
 CONFIG.PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -2,30 +2,107 @@
 # -* coding: utf-8 -*-
 
 import argparse
-import csv
+import contextlib
+import contextvars
 from datetime import datetime
-import json
+import functools
+import hashlib
+import io
 import libs.magic as magic
 import logging
 import os
 import shutil
+import struct
+from stat import S_ISREG
 import sys
+import threading
+import time
+import zlib
 
 import utils
 
+from libs.decompressor import DecompressorRegistry
+from libs.dedup import StagedDeduplicator
+from libs.digestindex import DigestIndex
+from libs.digestset import DigestSet
+from libs.filefilter import FileFilter, parse_size
+from libs.journal import Journal
 from libs.logger import init_logging
+from libs.mimetypetable import load_mimetype_table
+from libs.namereservation import NameReservation
+from libs.scheduler import AdaptiveScheduler
+from libs.summarydb import SummaryDatabase
+import libs.signature as signature
 from config import CONFIG
 
-COMMON_EXTENSION_LIST = []
-with open(os.path.join(CONFIG.PROJECT_DIR, 'mimetype.json'), 'r') as fd:
-    mimetype_dict = json.load(fd)
-    for mimemtype, extension_list in mimetype_dict.items():
-        for extension in extension_list:
-            if not extension.lower() in COMMON_EXTENSION_LIST:
-                COMMON_EXTENSION_LIST.append(extension.lower())
-COMMON_EXTENSION_LIST = sorted([X if X.startswith('.') else f'.{X}' for X in COMMON_EXTENSION_LIST], key=len)[::-1]
+def get_mimetype_table():
+    '''
+    return the MimetypeTable of the mimetypes and extensions listed in mimetype.json, loaded on first use
+    '''
+    return load_mimetype_table(os.path.join(CONFIG.PROJECT_DIR, 'mimetype.json'), cache_path=os.path.join(CONFIG.PROJECT_DIR, '__pycache__', 'mimetype.json.marshal'))
+
+# binary md5 digests of the imported files
+IMPORTED_FILE = DigestSet(digest_size=hashlib.md5().digest_size)
+# hex digests being processed by a worker, not yet in IMPORTED_FILE
+PENDING_FILE = set()
+IMPORTED_FILE_LOCK = threading.Lock()
+# persistent DigestIndex of the files imported by previous runs, if any
+DIGEST_INDEX = None
+# duplicate detection by size, then partial hash, then full hash (--staged-dedup), used instead of IMPORTED_FILE
+STAGED_DEDUP = StagedDeduplicator()
+
+# mimetypes processed by an extract_* function in process_file
+EXTRACTED_MIMETYPE_LIST = ['application/zstd', 'application/gzip', 'application/x-gtar', 'application/x-tar', 'application/x-7z-compressed', 'application/x-rar-compressed', 'application/zip', 'application/x-bzip2', 'application/x-xz']
+
+# number of files identified by their signature and by libmagic
+IDENTIFY_COUNT = {'signature': 0, 'libmagic': 0}
+IDENTIFY_COUNT_LOCK = threading.Lock()
+
+# Journal of the run, if it is journaled (--journal)
+JOURNAL = None
+# JournalTask of the file being processed by the current thread
+CURRENT_JOURNAL_TASK = contextvars.ContextVar('CURRENT_JOURNAL_TASK', default=None)
+
+# names handed out by get_next_available_path, per output directory
+RESERVED_NAME = NameReservation()
 
-IMPORTED_FILE = []
+# DecompressorRegistry of the external decompression tools, created on first use
+DECOMPRESSOR_REGISTRY = None
+
+# AdaptiveScheduler limiting the number of extractions running at once (--adaptive)
+SCHEDULER = None
+
+# FileFilter selecting the files to process (--include, --exclude...), None to process every file
+FILE_FILTER = None
+# member_filter(name, size) of the archive extracted by the current thread, None to extract every member
+MEMBER_FILTER = contextvars.ContextVar('MEMBER_FILTER', default=None)
+# files left out by FILE_FILTER: files found on disk or extracted, archive members not extracted at all
+FILTERED_COUNT = {'file': 0, 'member': 0}
+FILTERED_COUNT_LOCK = threading.Lock()
+
+# directory of the logs of the external commands, one per archive (--command-log)
+COMMAND_LOG_DIRECTORY = None
+
+# archive members up to this size named like an archive are kept in memory and extracted from there instead of being
+# written to the output tree and read back (--in-memory-size), 0 to write every member
+IN_MEMORY_SIZE = 0
+# bytes of the members kept in memory at once over the whole run (--in-memory-limit), the next ones are written to disk
+# defaults to the larger of 256 MiB and 16 times IN_MEMORY_SIZE
+IN_MEMORY_LIMIT = 256 * 1024 * 1024
+# bytes of the members currently kept in memory
+IN_MEMORY_HELD = 0
+IN_MEMORY_LOCK = threading.Lock()
+# formats the native backends extract from memory
+IN_MEMORY_MIMETYPE_LIST = ['application/gzip', 'application/x-gtar', 'application/x-tar', 'application/zip', 'application/x-bzip2', 'application/x-xz']
+# list receiving the MemoryFile of the members kept in memory by the archive extracted by the current thread
+MEMORY_FILE_LIST = contextvars.ContextVar('MEMORY_FILE_LIST', default=None)
+
+def get_command_log_path(original_filepath):
+    '''
+    return the log path of an archive: its input path under COMMAND_LOG_DIRECTORY, with a .log extension
+    '''
+    part_list = [X for X in os.path.normpath(original_filepath).split(os.sep) if X not in ['', '.', '..']]
+    return os.path.join(COMMAND_LOG_DIRECTORY, *part_list) + '.log'
 
 def get_next_available_path(path, delimiter='_', mkdir_parent=False, mkdir=False, extension=None, merge_dir=False):
     '''
@@ -34,68 +111,470 @@ def get_next_available_path(path, delimiter='_', mkdir_parent=False, mkdir=False
     if type(path) is list:
         path = os.path.join(*[X for X in path if X])
     path = os.path.normpath(path)
-    if os.path.exists(path) and not merge_dir:
-            index = 1
-            if extension:
-                new_path = f'{path[:-len(extension)]}{delimiter}{index}{extension}'
-            else:
-                new_path = f'{path}{delimiter}{index}'
-            while os.path.exists(new_path):
-                index += 1
-                if extension:
-                    new_path = f'{path[:-len(extension)]}{delimiter}{index}{extension}'
-                else:
-                    new_path = f'{path}{delimiter}{index}'
-            path = new_path
+    if not merge_dir:
+        path = RESERVED_NAME.reserve(path, delimiter=delimiter, extension=extension)
+        journal_task = CURRENT_JOURNAL_TASK.get()
+        if journal_task:
+            journal_task.add_output(path)
     if mkdir:
-        if not os.path.exists(path):
-            os.makedirs(path)
+        utils.make_directories(path)
     elif mkdir_parent:
-        parent_path = os.path.dirname(path)
-        if not os.path.exists(parent_path):
-            os.makedirs(parent_path)
+        utils.make_directories(os.path.dirname(path))
     return path  
 
-def explode_filepath(filepath):
+def explode_filepath(filepath, stat=None):
     '''
     /path/subfolder/file.ext
     dirname = /path/subfolder
     basename = file.ext
     filename = file
     extension = .ext
+    results are cached as long as the file is not modified, so each file is identified once
+    stat: os.stat_result of filepath if already known
+    '''
+    if stat is None:
+        stat = os.stat(filepath)
+    return _explode_filepath(filepath, stat.st_size, stat.st_mtime_ns, stat.st_ino, stat.st_mode)
+
+def identify_mimetype(filepath, mode):
     '''
-    mimetype = magic.from_file(filepath, mime=True).lower().strip()
+    return the libmagic mimetype of filepath
+    regular files are identified from the buffer of their first bytes: by the signature table for the common archive
+    formats, else by libmagic. libmagic needs the file itself for symbolic links, empty files, special files and
+    executables (the execute permission tells a PIE executable from a shared library)
+    '''
+    mimetype = None
+    method = 'libmagic'
+    if S_ISREG(mode) and not mode & 0o111:
+        try:
+            fd = os.open(filepath, os.O_RDONLY | getattr(os, 'O_NOFOLLOW', 0))
+        except OSError:
+            # ELOOP for a symbolic link
+            fd = None
+        if fd is not None:
+            with open(fd, 'rb') as fd:
+                header = fd.read(signature.HEADER_SIZE)
+                mimetype = signature.sniff(header)
+                if mimetype:
+                    method = 'signature'
+                elif header:
+                    header += fd.read(magic.BYTES_MAX - len(header))
+                    mimetype = magic.from_buffer(header, mime=True)
+    if mimetype is None:
+        mimetype = magic.from_file(filepath, mime=True)
+    with IDENTIFY_COUNT_LOCK:
+        IDENTIFY_COUNT[method] += 1
+    return mimetype
+
+@functools.lru_cache(maxsize=4096)
+def _explode_filepath(filepath, size, mtime_ns, inode, mode):
+    mimetype = identify_mimetype(filepath, mode).lower().strip()
     dirname = os.path.dirname(filepath)
     basename = os.path.basename(filepath)
-    filename = basename
-    extension = None
-    lower_basename = basename.lower()
-    if '.' in basename:
-        for ext in COMMON_EXTENSION_LIST:
-            if lower_basename.endswith(ext):
-                extension = basename[-len(ext):]
-                filename = basename[:-len(ext)]
-                break
-        if not extension:
-            extension = f'.{basename.split(".")[-1]}'
-            filename = basename[:-len(extension)]
-    if mimetype == 'application/gzip' and extension.endswith('.gz') and len(extension) > 3:
+    filename, extension = split_filename(basename, mimetype)
+    return dirname, basename, filename, extension, mimetype
+
+def split_filename(basename, mimetype):
+    '''
+    file.tar.gz -> (file.tar, .gz) for a gzip file, (filename, extension) from the mimetype table otherwise
+    '''
+    filename, extension = get_mimetype_table().split_extension(basename)
+    if mimetype == 'application/gzip' and extension and extension.endswith('.gz') and len(extension) > 3:
         filename += extension[:-3]
         extension = '.gz'
-    return dirname, basename, filename, extension, mimetype
-        
-def extract_zst(filepath, output_root, relative_path, filename, extension, basename, merge_dir=False):
+    return filename, extension
+
+def identify_buffer(header):
     '''
-    compression only
+    return the libmagic mimetype of content from its first magic.BYTES_MAX bytes, for the files which are not on disk
+    '''
+    mimetype = signature.sniff(header[:signature.HEADER_SIZE])
+    method = 'signature'
+    if not mimetype:
+        mimetype = magic.from_buffer(header, mime=True)
+        method = 'libmagic'
+    with IDENTIFY_COUNT_LOCK:
+        IDENTIFY_COUNT[method] += 1
+    return mimetype.lower().strip()
+
+def is_archive_name(path, mimetype_list=EXTRACTED_MIMETYPE_LIST):
+    '''
+    return True if the extension of path is the one of a format of mimetype_list, by default the extracted formats
+    '''
+    mimetype_table = get_mimetype_table()
+    basename = os.path.basename(path)
+    extension_list = [mimetype_table.split_extension(basename)[1], os.path.splitext(basename)[1]]
+    return any(X in mimetype_list for extension in extension_list if extension for X in mimetype_table.get_mimetype_list(extension))
+
+class MemoryFile:
+    '''
+    Archive member kept in memory instead of being extracted (see IN_MEMORY_SIZE)
+    path is where it would have been extracted, it is only written there by spill(), if it can not be extracted
+    from memory. mtime is the modification time of the member, restored on the written file
+    data counts against IN_MEMORY_LIMIT until release()
+    '''
+    def __init__(self, path, data, mtime=None):
+        self.path = path
+        self.data = data
+        self.mtime = mtime
+        self.spilled = False
+        self.exploded = None
+
+    def explode(self):
+        '''
+        same as explode_filepath, the content is identified once
+        '''
+        if self.exploded is None:
+            mimetype = identify_buffer(self.data[:magic.BYTES_MAX])
+            basename = os.path.basename(self.path)
+            filename, extension = split_filename(basename, mimetype)
+            self.exploded = (os.path.dirname(self.path), basename, filename, extension, mimetype)
+        return self.exploded
+
+    def spill(self):
+        '''
+        write the content to path, it is not needed in memory anymore
+        '''
+        utils.make_directories(os.path.dirname(self.path))
+        with open(self.path, 'wb') as fd:
+            fd.write(self.data)
+        if self.mtime is not None:
+            os.utime(self.path, (self.mtime, self.mtime))
+        self.spilled = True
+        self.release()
+
+    def release(self):
+        '''
+        drop the content once it is extracted or written out
+        '''
+        if self.data is not None:
+            reserve_memory(-len(self.data))
+            self.data = None
+
+def reserve_memory(size):
+    '''
+    count size bytes more (less if negative) against IN_MEMORY_LIMIT, return False if that would exceed it
+    '''
+    global IN_MEMORY_HELD
+    with IN_MEMORY_LOCK:
+        if size > 0 and IN_MEMORY_HELD + size > IN_MEMORY_LIMIT:
+            return False
+        IN_MEMORY_HELD += size
+        return True
+
+def hold_in_memory(output_directory, name, size, opener, mtime=None):
+    '''
+    keep a member of the archive being extracted in MEMORY_FILE_LIST instead of extracting it to output_directory
+    if it is small enough, named like an archive and IN_MEMORY_LIMIT is not reached, opener returns its content as
+    a stream
+    return True if the member is kept
+    '''
+    memory_file_list = MEMORY_FILE_LIST.get()
+    if memory_file_list is None or size > IN_MEMORY_SIZE:
+        return False
+    if os.path.isabs(name) or '..' in name.replace('\\', '/').split('/') or not is_archive_name(name, IN_MEMORY_MIMETYPE_LIST):
+        return False
+    if not reserve_memory(size):
+        return False
+    try:
+        with opener() as fd:
+            data = fd.read()
+    except BaseException:
+        reserve_memory(-size)
+        raise
+    # the size read may differ from the one of the member header
+    reserve_memory(len(data) - size)
+    # the path stays reserved so no sibling output takes it before the member is exploded or spilled
+    path = RESERVED_NAME.reserve(os.path.normpath(os.path.join(output_directory, name)))
+    memory_file_list.append(MemoryFile(path, data, mtime=mtime))
+    return True
+
+def count_filtered(kind):
+    with FILTERED_COUNT_LOCK:
+        FILTERED_COUNT[kind] += 1
+
+def is_file_selected(path, size, mimetype):
+    '''
+    return True if FILE_FILTER selects the file, archives are extracted unless they are excluded
+    '''
+    if mimetype in EXTRACTED_MIMETYPE_LIST:
+        return not FILE_FILTER.is_excluded(path, mimetype)
+    return FILE_FILTER.match(path, size, mimetype)
+
+def get_member_filter(archive_path):
+    '''
+    return member_filter(name, size) selecting the members of the archive at archive_path (input path) before
+    they are extracted, by name and size only. Members named like archives are kept unless excluded: their content
+    may match. The mimetype of the members is checked once they are extracted
+    '''
+    def member_filter(name, size):
+        path = os.path.join(archive_path, name)
+        if is_archive_name(name):
+            selected = not FILE_FILTER.is_excluded(path)
+        else:
+            selected = FILE_FILTER.match(path, size)
+        if not selected:
+            count_filtered('member')
+        return selected
+    return member_filter
+
+def native_decompress(opener, filepath, output_fd):
+    '''
+    compression only: decompress filepath into output_fd with a python stream opener (gzip.open, bz2.open...)
+    return values follow utils.do_system_command with a stdout file descriptor
+    '''
+    try:
+        with opener(filepath, 'rb') as fd:
+            shutil.copyfileobj(fd, output_fd, 1024 * 1024)
+    except Exception:
+        # leave output_fd empty for the external binary
+        output_fd.seek(0)
+        output_fd.truncate()
+        raise
+    return None, '', 0
+
+def native_extract_tar(filepath, output_directory, mode='r:*', fileobj=None):
     '''
+    archiving only or archiving and compression depending on mode
+    fileobj is read instead of filepath if set, use a stream mode (r|) if it is not seekable
+    return values follow utils.do_system_command, stdout is the member list as printed by tar xv
+    '''
+    import tarfile
+    # extraction filter rejecting member names outside the output directory, like GNU tar (python 3.9.17+)
+    # symlinks are extracted whatever their target, as filesystem images are full of absolute ones
+    extract_option = {'filter': 'tar'} if hasattr(tarfile, 'tar_filter') else {}
+    stdout = utils.OutputTail()
+    stderr = utils.OutputTail()
+    member_filter = MEMBER_FILTER.get()
+    with tarfile.open(filepath, mode, fileobj=fileobj) as tar:
+        for member in tar:
+            if member_filter is not None and member.isfile() and not member_filter(member.name, member.size):
+                continue
+            if not extract_option and (os.path.isabs(member.name) or '..' in member.name.split('/')):
+                stderr.write(os.fsencode(f'{member.name}: refusing to extract member outside of the output directory\n'))
+                continue
+            try:
+                if not (member.isfile() and hold_in_memory(output_directory, member.name, member.size, lambda: tar.extractfile(member), mtime=member.mtime)):
+                    tar.extract(member, output_directory, **extract_option)
+                stdout.write(os.fsencode(member.name + '\n'))
+            except (tarfile.TarError, OSError) as e:
+                stderr.write(os.fsencode(f'{member.name}: {e}\n'))
+    # same exit code as tar when some members could not be extracted
+    return stdout.getvalue(), stderr.getvalue(), 2 if stderr.length else 0
+
+def get_zip_member_mtime(member):
+    '''
+    return the modification time of a zip member as a timestamp, as unzip restores it: the UTC time of the extended
+    timestamp extra field if any, else the DOS date and time of the member header, in local time
+    '''
+    extra = member.extra
+    while len(extra) >= 4:
+        header_id, size = struct.unpack('<HH', extra[:4])
+        data = extra[4:4 + size]
+        # extended timestamp, flags then the modification time if bit 0 is set
+        if header_id == 0x5455 and len(data) >= 5 and data[0] & 1:
+            return struct.unpack('<I', data[1:5])[0]
+        extra = extra[4 + size:]
+    try:
+        return time.mktime(member.date_time + (0, 0, -1))
+    except (OverflowError, ValueError):
+        return None
+
+def native_extract_zip(filepath, output_directory):
+    '''
+    archiving and compression
+    the modification times of the members are restored like unzip does, the ones of the directories once they are filled
+    return values follow utils.do_system_command, stdout is the member list
+    '''
+    import zipfile
+    stdout = utils.OutputTail()
+    member_filter = MEMBER_FILTER.get()
+    directory_list = []
+    with zipfile.ZipFile(filepath) as archive:
+        for member in archive.infolist():
+            if member_filter is not None and not member.is_dir() and not member_filter(member.filename, member.file_size):
+                continue
+            # member names are sanitized by zipfile
+            if member.is_dir() or not hold_in_memory(output_directory, member.filename, member.file_size, lambda: archive.open(member), mtime=get_zip_member_mtime(member)):
+                path = archive.extract(member, output_directory)
+                mtime = get_zip_member_mtime(member)
+                if mtime is not None:
+                    if member.is_dir():
+                        directory_list.append((path, mtime))
+                    else:
+                        os.utime(path, (mtime, mtime))
+            stdout.write(os.fsencode(member.filename + '\n'))
+    for path, mtime in reversed(directory_list):
+        os.utime(path, (mtime, mtime))
+    return stdout.getvalue(), '', 0
+
+def is_tar_header(header):
+    '''
+    check the ustar magic or, for pre-POSIX archives, the header checksum of the first tar block
+    '''
+    import tarfile
+    if len(header) < tarfile.BLOCKSIZE:
+        return False
+    if header[257:262] == b'ustar':
+        return True
+    try:
+        checksum = int(header[148:156].replace(b'\0', b' ').strip(), 8)
+    except ValueError:
+        return False
+    return checksum == sum(header[:148]) + 8 * 0x20 + sum(header[156:512])
+
+def stream_to_output(stream, output_root, relative_path, filename, merge_dir=False):
+    '''
+    compression only: write a decompressed stream to the output tree
+    a tar archive is unpacked straight to an output directory instead of writing the intermediate tar file
+    return values follow utils.do_system_command plus the output path
+    errors are only raised while reading the head of the stream, that is before anything is written
+    '''
+    import tarfile
+    header = stream.read(tarfile.BLOCKSIZE)
+    if is_tar_header(header):
+        if filename.lower().endswith('.tar'):
+            filename = filename[:-len('.tar')]
+        output_directory = get_next_available_path([output_root, relative_path, filename], mkdir=True, merge_dir=merge_dir)
+        try:
+            stdout, stderr, code = native_extract_tar(None, output_directory, mode='r|', fileobj=utils.PrefixedStream(header, stream))
+            # read the end of archive padding so the decompressor checks the stream up to its end
+            while stream.read(1024 * 1024):
+                pass
+        except (tarfile.TarError, OSError, EOFError, zlib.error) as e:
+            return None, str(e), 1, output_directory
+        return stdout, stderr, code, output_directory
     output_filepath = get_next_available_path([output_root, relative_path, filename], mkdir_parent=True, merge_dir=merge_dir)
-    
-    stdout, stderr, code = utils.do_system_command([CONFIG['bin.zstd'], '-d', '-f', '-o', output_filepath, filepath])
+    try:
+        with open(output_filepath, 'wb') as fd:
+            shutil.copyfileobj(utils.PrefixedStream(header, stream), fd, 1024 * 1024)
+    except (OSError, EOFError, zlib.error) as e:
+        return None, str(e), 1, output_filepath
+    return None, '', 0, output_filepath
+
+def stream_command_to_output(command, output_root, relative_path, filename, merge_dir=False):
+    '''
+    stream_to_output on the stdout of command
+    '''
+    stdout = None
+    stderr = ''
+    code = None
+    output_path = None
+    with utils.CommandStream(command) as process:
+        try:
+            stdout, stderr, code, output_path = stream_to_output(process.stdout, output_root, relative_path, filename, merge_dir=merge_dir)
+        except OSError as e:
+            stderr = str(e)
+            code = 1
+    stderr = '\n'.join([X for X in [process.stderr.strip(), stderr] if X])
+    if process.returncode != 0:
+        code = process.returncode
+    return stdout, stderr, code, output_path
+
+def run_extraction(backend, native_function, native_args, command, stdout=None):
+    '''
+    Run native_function if the native backend is selected for this format, else or if it fails, run the external command
+    return values follow utils.do_system_command plus the name of the backend used
+    '''
+    if CONFIG[f'backend.{backend}'] in ['native', 'auto']:
+        try:
+            return (*native_function(*native_args), 'native')
+        except Exception as e:
+            logging.warning(f'Native {backend} backend failed on {native_args[1]} ({e}): falling back to {command[0]}')
+    return (*utils.do_system_command(command, stdout=stdout), os.path.basename(command[0]))
+
+def get_decompressor(format):
+    '''
+    return the fastest installed Decompressor of format (gz, bz2, xz, zst), None if none is installed
+    '''
+    global DECOMPRESSOR_REGISTRY
+    if DECOMPRESSOR_REGISTRY is None:
+        DECOMPRESSOR_REGISTRY = DecompressorRegistry(path_dict={X: CONFIG[f'bin.{X}'] for X in ['pigz', 'gzip', 'lbzip2', 'pbzip2', 'bzip2', 'xz', 'zstd']})
+    return DECOMPRESSOR_REGISTRY.find(format)
+
+def select_decompressor(backend, format=None):
+    '''
+    return the external Decompressor to use for format according to CONFIG backend.<backend>, None to use the native backend
+    auto selects the fastest installed tool if it is multithreaded, system the fastest installed tool
+    '''
+    mode = CONFIG[f'backend.{backend}']
+    if mode == 'native':
+        return None
+    decompressor = get_decompressor(format or backend)
+    if mode == 'auto' and decompressor is not None and not decompressor.threaded:
+        return None
+    return decompressor
+
+def decompress(backend, opener, filepath, output_root, relative_path, filename, merge_dir=False):
+    '''
+    compression only: decompress filepath with the python stream opener (gzip.open, lzma.open...) or with the external
+    Decompressor selected for backend, always the external one if opener is None
+    a tar archive inside is unpacked straight to an output directory if backend.stream_tar is set
+    return values follow extract_* functions
+    '''
+    decompressor = select_decompressor(backend) if opener else get_decompressor(backend)
+    if decompressor is None and not opener:
+        return False, None, f'No {backend} decompressor found', None, None, None
+    if CONFIG['backend.stream_tar']:
+        if decompressor is None:
+            try:
+                with opener(filepath, 'rb') as stream:
+                    stdout, stderr, code, output_path = stream_to_output(stream, output_root, relative_path, filename, merge_dir=merge_dir)
+                backend_name = 'native'
+            except Exception as e:
+                # zlib.error, lzma.LZMAError, OSError... raised by the head of the stream, before anything is written
+                decompressor = get_decompressor(backend)
+                if decompressor is None:
+                    return False, None, str(e), 1, None, 'native'
+                logging.warning(f'Native {backend} backend failed on {filepath} ({e}): falling back to {decompressor.name}')
+        if decompressor is not None:
+            stdout, stderr, code, output_path = stream_command_to_output(decompressor.get_command(filepath), output_root, relative_path, filename, merge_dir=merge_dir)
+            backend_name = decompressor.name
+    else:
+        output_path = get_next_available_path([output_root, relative_path, filename], mkdir_parent=True, merge_dir=merge_dir)
+        with open(output_path, 'wb') as fd:
+            if decompressor is None:
+                try:
+                    stdout, stderr, code = native_decompress(opener, filepath, fd)
+                    backend_name = 'native'
+                except Exception as e:
+                    decompressor = get_decompressor(backend)
+                    if decompressor is None:
+                        return False, None, str(e), 1, output_path, 'native'
+                    logging.warning(f'Native {backend} backend failed on {filepath} ({e}): falling back to {decompressor.name}')
+            if decompressor is not None:
+                stdout, stderr, code = utils.do_system_command(decompressor.get_command(filepath), stdout=fd)
+                backend_name = decompressor.name
     if code == 0:
-        return True, stdout, stderr, code, output_filepath
+        return True, stdout, stderr, code, output_path, backend_name
     else:
         print(stderr)
-        return False, stdout, stderr, code, output_filepath
+        return False, stdout, stderr, code, output_path, backend_name
+
+def extract_compressed_tar(backend, format, native_mode, tar_option, filepath, output_directory):
+    '''
+    archiving and compression: unpack a compressed tar archive with the native backend, or with tar decompressing
+    through the external Decompressor selected for backend
+    return values follow run_extraction
+    '''
+    decompressor = select_decompressor(backend, format)
+    if decompressor is not None:
+        command = [CONFIG['bin.tar'], '-xvf', filepath, '-C', output_directory, f'--use-compress-program={decompressor.get_program()}']
+        return (*utils.do_system_command(command), f'tar+{decompressor.name}')
+    return run_extraction(backend, native_extract_tar, [filepath, output_directory, native_mode], [CONFIG['bin.tar'], tar_option, filepath, '-C', output_directory])
+
+def extract_zst(filepath, output_root, relative_path, filename, extension, basename, merge_dir=False):
+    '''
+    compression only
+    '''
+    return decompress('zst', None, filepath, output_root, relative_path, filename, merge_dir=merge_dir)
+
+def extract_xz(filepath, output_root, relative_path, filename, extension, basename, merge_dir=False):
+    '''
+    compression only
+    '''
+    import lzma
+    return decompress('xz', lzma.open, filepath, output_root, relative_path, filename, merge_dir=merge_dir)
 
 def extract_rar(filepath, output_root, relative_path, filename, extension, basename, merge_dir=False):
     '''
@@ -104,89 +583,173 @@ def extract_rar(filepath, output_root, relative_path, filename, extension, basen
     output_directory = get_next_available_path([output_root, relative_path, filename], mkdir=True, merge_dir=merge_dir)
     stdout, stderr, code = utils.do_system_command([CONFIG['bin.tar'], 'xvf', filepath, '-C', output_directory])
     if code == 0:
-        return True, stdout, stderr, code, output_directory
+        return True, stdout, stderr, code, output_directory, 'tar'
     else:
         print(stderr)
-        return False, stdout, stderr, code, output_directory
+        return False, stdout, stderr, code, output_directory, 'tar'
 
 def extract_zip(filepath, output_root, relative_path, filename, extension, basename, merge_dir=False):
     '''
     archiving and compression
     '''
     output_directory = get_next_available_path([output_root, relative_path, filename], mkdir=True, merge_dir=merge_dir)
-    stdout, stderr, code = utils.do_system_command([CONFIG['bin.unzip'], '-o', '-d', output_directory, filepath])
+    stdout, stderr, code, backend_name = run_extraction('zip', native_extract_zip, [filepath, output_directory], [CONFIG['bin.unzip'], '-o', '-d', output_directory, filepath])
     if code == 0:
-        return True, stdout, stderr, code, output_directory
+        return True, stdout, stderr, code, output_directory, backend_name
     else:
         print(stderr)
 
-        return False, stdout, stderr, code, output_directory
+        return False, stdout, stderr, code, output_directory, backend_name
+
+def list_7z(filepath):
+    '''
+    return the (name, size) of the files of a 7z archive as listed by 7z l -slt, None if it can not be listed
+    '''
+    member_list = []
+    member = {}
+    with utils.CommandStream([CONFIG['bin.sevenz'], 'l', '-slt', filepath]) as process:
+        # the properties of the archive come first, then a ---------- line and a block per member
+        in_member_list = False
+        for line in process.stdout:
+            line = line.decode(errors='surrogateescape').rstrip('\r\n')
+            if not in_member_list:
+                in_member_list = line.startswith('----------')
+            elif line:
+                key, _, value = line.partition(' = ')
+                member[key] = value
+            elif member:
+                if 'Path' in member and member.get('Folder') != '+' and 'D' not in member.get('Attributes', ''):
+                    member_list.append((member['Path'], int(member.get('Size') or 0)))
+                member = {}
+        if member and 'Path' in member and member.get('Folder') != '+' and 'D' not in member.get('Attributes', ''):
+            member_list.append((member['Path'], int(member.get('Size') or 0)))
+    if process.returncode != 0:
+        return None
+    return member_list
 
 def extract_7z(filepath, output_root, relative_path, filename, extension, basename, merge_dir=False):
     '''
     archiving and compression
+    only the members selected by MEMBER_FILTER are extracted, from the list of the archive members
     '''
     output_directory = get_next_available_path([output_root, relative_path, filename], mkdir=True, merge_dir=merge_dir)
-    stdout, stderr, code = utils.do_system_command([CONFIG['bin.sevenz'], '-y', f'-o{output_directory}', 'x', filepath])
+    command = [CONFIG['bin.sevenz'], '-y', f'-o{output_directory}', 'x', filepath]
+    member_filter = MEMBER_FILTER.get()
+    member_list = list_7z(filepath) if member_filter is not None else None
+    listfile_path = None
+    if member_list is not None:
+        selected_list = [X for X, Y in member_list if member_filter(X, Y)]
+        if not selected_list:
+            return True, '', '', 0, output_directory, '7z'
+        if len(selected_list) < len(member_list):
+            import tempfile
+            with tempfile.NamedTemporaryFile('w', encoding='utf-8', errors='surrogateescape', suffix='.txt', delete=False) as fd:
+                fd.write('\n'.join(selected_list) + '\n')
+                listfile_path = fd.name
+            # names of the list file are not wildcards
+            command += ['-spd', '-scsUTF-8', f'@{listfile_path}']
+    try:
+        stdout, stderr, code = utils.do_system_command(command)
+    finally:
+        if listfile_path:
+            os.unlink(listfile_path)
     if code == 0:
-        return True, stdout, stderr, code, output_directory
+        return True, stdout, stderr, code, output_directory, '7z'
     else:
         print(stderr)
-        return False, stdout, stderr, code, output_directory
+        return False, stdout, stderr, code, output_directory, '7z'
 
 def extract_tar(filepath, output_root, relative_path, filename, extension, basename, merge_dir=False):
     '''
     archiving only
     '''
     output_directory = get_next_available_path([output_root, relative_path, filename], mkdir=True, merge_dir=merge_dir)
-    stdout, stderr, code = utils.do_system_command([CONFIG['bin.tar'], 'xvf', filepath, '-C', output_directory])
+    stdout, stderr, code, backend_name = run_extraction('tar', native_extract_tar, [filepath, output_directory, 'r:*'], [CONFIG['bin.tar'], 'xvf', filepath, '-C', output_directory])
     if code == 0:
-        return True, stdout, stderr, code, output_directory
+        return True, stdout, stderr, code, output_directory, backend_name
     else:
         print(stderr)
-        return False, stdout, stderr, code, output_directory
+        return False, stdout, stderr, code, output_directory, backend_name
     
 def extract_gz(filepath, output_root, relative_path, filename, extension, basename, merge_dir=False):
     '''
     compression only
     '''
-    output_filepath = get_next_available_path([output_root, relative_path, filename], mkdir_parent=True, merge_dir=merge_dir)
-    stdout_fd = open(output_filepath, 'wb')
-    _, stderr, code = utils.do_system_command([CONFIG['bin.gzip'], '-c', '-f', '-k', '-d', filepath], stdout=stdout_fd)
-    stdout_fd.close()
-    if code == 0:
-        return True, None, stderr, code, output_filepath
-    else:
-        print(stderr)
-        return False, None, stderr, code, output_filepath
+    import gzip
+    return decompress('gz', gzip.open, filepath, output_root, relative_path, filename, merge_dir=merge_dir)
 
 def extract_tgz(filepath, output_root, relative_path, filename, extension, basename, merge_dir=False):
     '''
     archiving and compression
     '''
     output_directory = get_next_available_path([output_root, relative_path, filename], mkdir=True, merge_dir=merge_dir)
-    stdout, stderr, code = utils.do_system_command([CONFIG['bin.tar'], 'xzvf', filepath, '-C', output_directory])
+    stdout, stderr, code, backend_name = extract_compressed_tar('tgz', 'gz', 'r:gz', 'xzvf', filepath, output_directory)
     if code == 0:
-        return True, stdout, stderr, code, output_directory
+        return True, stdout, stderr, code, output_directory, backend_name
     else:
         print(stderr)
-        return False, stdout, stderr, code, output_directory
+        return False, stdout, stderr, code, output_directory, backend_name
 
 def extract_bz2(filepath, output_root, relative_path, filename, extension, basename, merge_dir=False):
     '''
     archiving and compression
     '''
     output_directory = get_next_available_path([output_root, relative_path, filename], mkdir=True, merge_dir=merge_dir)
-    stdout, stderr, code = utils.do_system_command([CONFIG['bin.tar'], 'xjvf', filepath, '-C', output_directory])
+    stdout, stderr, code, backend_name = extract_compressed_tar('bz2', 'bz2', 'r:bz2', 'xjvf', filepath, output_directory)
     if code == 0:
-        return True, stdout, stderr, code, output_directory
+        return True, stdout, stderr, code, output_directory, backend_name
     else:
         print(stderr)
-        return False, stdout, stderr, code, output_directory
+        return False, stdout, stderr, code, output_directory, backend_name
 
-def process_file(input_filepath, output_root, input_root=None, original_filepath=None, remove_source=False, merge_dir=False, mimetype_whitelist=[], mimetype_blacklist=[]):
+def extract_in_memory(data, mimetype, output_root, relative_path, filename, merge_dir=False):
+    '''
+    extract an archive held in memory (MemoryFile) with the native backends, mimetype is one of IN_MEMORY_MIMETYPE_LIST
+    return values follow extract_* functions
+    '''
+    import libs.archivestream as archivestream
+    stream = io.BytesIO(data)
+    output_path = None
+    try:
+        if mimetype in ['application/x-tar', 'application/x-gtar', 'application/x-bzip2']:
+            output_path = get_next_available_path([output_root, relative_path, filename], mkdir=True, merge_dir=merge_dir)
+            stdout, stderr, code = native_extract_tar(None, output_path, 'r:*', fileobj=stream)
+        elif mimetype == 'application/zip':
+            output_path = get_next_available_path([output_root, relative_path, filename], mkdir=True, merge_dir=merge_dir)
+            stdout, stderr, code = native_extract_zip(stream, output_path)
+        elif CONFIG['backend.stream_tar']:
+            stdout, stderr, code, output_path = stream_to_output(archivestream.open_decompressed(mimetype, stream), output_root, relative_path, filename, merge_dir=merge_dir)
+        else:
+            output_path = get_next_available_path([output_root, relative_path, filename], mkdir_parent=True, merge_dir=merge_dir)
+            with open(output_path, 'wb') as fd:
+                shutil.copyfileobj(archivestream.open_decompressed(mimetype, stream), fd, 1024 * 1024)
+            stdout, stderr, code = None, '', 0
+    except Exception as e:
+        # RuntimeError for an encrypted zip, NotImplementedError for an unsupported compression method...
+        return False, None, str(e), 1, output_path, 'native'
+    return code == 0, stdout, stderr, code, output_path, 'native'
+
+def discard_output(output_path):
+    '''
+    remove the partial output of a failed extraction and free its name
+    '''
+    if not output_path:
+        return
+    if os.path.isdir(output_path) and not os.path.islink(output_path):
+        shutil.rmtree(output_path)
+    elif os.path.lexists(output_path):
+        os.unlink(output_path)
+    RESERVED_NAME.release(output_path)
+
+def process_file(input_filepath, output_root, input_root=None, original_filepath=None, remove_source=False, merge_dir=False, mimetype_whitelist=[], mimetype_blacklist=[], file_hash=None, stat=None, memory_file=None, memory_file_list=None):
     '''
     Process file depending on the mimetype. If no processing is needed, then res is None
+    backend_name is the name of the backend which extracted the file (native, pigz, tar+lbzip2...), None if not extracted
+    file_hash (hashlib or utils.MultiHash object) is fed with the content of input_filepath: while copying it if the
+    file is copied, in the hashing thread pool while extracting it if it is an archive
+    memory_file: MemoryFile of input_filepath if it is held in memory, it is written to input_filepath if it can not be
+    extracted from memory
+    memory_file_list: list receiving the MemoryFile of the members kept in memory by the extraction
     '''
     if not original_filepath:
         original_filepath = input_filepath
@@ -196,34 +759,78 @@ def process_file(input_filepath, output_root, input_root=None, original_filepath
         relative_path = None
 
     # here filename is basename without the extension
-    _, basename, filename, extension, mimetype = explode_filepath(input_filepath)
+    if memory_file is None:
+        _, basename, filename, extension, mimetype = explode_filepath(input_filepath, stat=stat)
+    else:
+        _, basename, filename, extension, mimetype = memory_file.explode()
     res = None
     stderr = None
     stdout = None
     code = None
     output_filepath = None
+    backend_name = None
 
-    if (not mimetype_whitelist or mimetype in mimetype_whitelist) and (not mimetype_blacklist or mimetype not in mimetype_blacklist):
-        if mimetype == 'application/zstd':
-            res, stderr, stdout, code, output_filepath = extract_zst(input_filepath, output_root, relative_path, filename, extension, basename, merge_dir=merge_dir)
-        elif mimetype == 'application/gzip':
-            res, stderr, stdout, code, output_filepath = extract_gz(input_filepath, output_root, relative_path, filename, extension, basename, merge_dir=merge_dir)
-        elif mimetype == 'application/x-gtar':
-            res, stderr, stdout, code, output_filepath = extract_tgz(input_filepath, output_root, relative_path, filename, extension, basename, merge_dir=merge_dir)
-        elif mimetype == 'application/x-tar':
-            res, stderr, stdout, code, output_filepath = extract_tar(input_filepath, output_root, relative_path, filename, extension, basename, merge_dir=merge_dir)
-        elif mimetype == 'application/x-7z-compressed':
-            res, stderr, stdout, code, output_filepath = extract_7z(input_filepath, output_root, relative_path, filename, extension, basename, merge_dir=merge_dir)
-        elif mimetype == 'application/x-rar-compressed':
-            res, stderr, stdout, code, output_filepath = extract_rar(input_filepath, output_root, relative_path, filename, extension, basename, merge_dir=merge_dir)
-        elif mimetype == 'application/zip':
-            res, stderr, stdout, code, output_filepath = extract_zip(input_filepath, output_root, relative_path, filename, extension, basename, merge_dir=merge_dir)
-        elif mimetype == 'application/x-bzip2':
-            res, stderr, stdout, code, output_filepath = extract_bz2(input_filepath, output_root, relative_path, filename, extension, basename, merge_dir=merge_dir)
-        elif mimetype == 'application/x-xz':
-            pass
-        elif mimetype == 'application/java-archive':
-            pass
+    selected = (not mimetype_whitelist or mimetype in mimetype_whitelist) and (not mimetype_blacklist or mimetype not in mimetype_blacklist)
+    if memory_file is not None:
+        if file_hash:
+            file_hash.update(memory_file.data)
+            file_hash = None
+        if not selected or mimetype not in IN_MEMORY_MIMETYPE_LIST:
+            memory_file.spill()
+            memory_file = None
+    hash_future = None
+    if file_hash and selected and mimetype in EXTRACTED_MIMETYPE_LIST:
+        hash_future = utils.submit_update_hash(input_filepath, file_hash)
+        file_hash = None
+    command_log_token = None
+    if COMMAND_LOG_DIRECTORY and selected and mimetype in EXTRACTED_MIMETYPE_LIST:
+        command_log_token = utils.COMMAND_LOG_PATH.set(get_command_log_path(original_filepath or input_filepath))
+    member_filter_token = None
+    if FILE_FILTER is not None and selected and mimetype in EXTRACTED_MIMETYPE_LIST:
+        member_filter_token = MEMBER_FILTER.set(get_member_filter(os.path.normpath(original_filepath)))
+    memory_file_token = None
+    if memory_file_list is not None and selected and mimetype in EXTRACTED_MIMETYPE_LIST:
+        memory_file_token = MEMORY_FILE_LIST.set(memory_file_list)
+    extraction_slot = contextlib.nullcontext()
+    if SCHEDULER is not None and selected and mimetype in EXTRACTED_MIMETYPE_LIST:
+        extraction_slot = SCHEDULER.slot(len(memory_file.data) if memory_file else stat.st_size if stat else os.path.getsize(input_filepath))
+    if selected:
+        with extraction_slot:
+            if memory_file is not None:
+                held_number = len(memory_file_list) if memory_file_list is not None else 0
+                res, stdout, stderr, code, output_filepath, backend_name = extract_in_memory(memory_file.data, mimetype, output_root, relative_path, filename, merge_dir=merge_dir)
+                if not res:
+                    # extracted again from disk, where the external backends take over from the native ones
+                    logging.warning(f'Extraction from memory failed on {os.path.normpath(original_filepath)} ({stderr}): extracting it from disk')
+                    discard_output(output_filepath)
+                    if memory_file_list is not None:
+                        for member_file in memory_file_list[held_number:]:
+                            member_file.release()
+                        del memory_file_list[held_number:]
+                    memory_file.spill()
+                    memory_file = None
+                    res = stdout = stderr = code = output_filepath = backend_name = None
+            if memory_file is None:
+                if mimetype == 'application/zstd':
+                    res, stdout, stderr, code, output_filepath, backend_name = extract_zst(input_filepath, output_root, relative_path, filename, extension, basename, merge_dir=merge_dir)
+                elif mimetype == 'application/gzip':
+                    res, stdout, stderr, code, output_filepath, backend_name = extract_gz(input_filepath, output_root, relative_path, filename, extension, basename, merge_dir=merge_dir)
+                elif mimetype == 'application/x-gtar':
+                    res, stdout, stderr, code, output_filepath, backend_name = extract_tgz(input_filepath, output_root, relative_path, filename, extension, basename, merge_dir=merge_dir)
+                elif mimetype == 'application/x-tar':
+                    res, stdout, stderr, code, output_filepath, backend_name = extract_tar(input_filepath, output_root, relative_path, filename, extension, basename, merge_dir=merge_dir)
+                elif mimetype == 'application/x-7z-compressed':
+                    res, stdout, stderr, code, output_filepath, backend_name = extract_7z(input_filepath, output_root, relative_path, filename, extension, basename, merge_dir=merge_dir)
+                elif mimetype == 'application/x-rar-compressed':
+                    res, stdout, stderr, code, output_filepath, backend_name = extract_rar(input_filepath, output_root, relative_path, filename, extension, basename, merge_dir=merge_dir)
+                elif mimetype == 'application/zip':
+                    res, stdout, stderr, code, output_filepath, backend_name = extract_zip(input_filepath, output_root, relative_path, filename, extension, basename, merge_dir=merge_dir)
+                elif mimetype == 'application/x-bzip2':
+                    res, stdout, stderr, code, output_filepath, backend_name = extract_bz2(input_filepath, output_root, relative_path, filename, extension, basename, merge_dir=merge_dir)
+                elif mimetype == 'application/x-xz':
+                    res, stdout, stderr, code, output_filepath, backend_name = extract_xz(input_filepath, output_root, relative_path, filename, extension, basename, merge_dir=merge_dir)
+                elif mimetype == 'application/java-archive':
+                    pass
 
         # copy raw file
         if res is None:
@@ -233,21 +840,72 @@ def process_file(input_filepath, output_root, input_root=None, original_filepath
                 output_filepath = os.path.normpath(os.path.join(output_root, basename))
             if output_filepath != os.path.normpath(input_filepath):
                 output_filepath = get_next_available_path([output_root, relative_path, basename], extension=extension)
-                if not os.path.exists(os.path.dirname(output_filepath)):
-                    os.makedirs(os.path.dirname(output_filepath))
-                shutil.copyfile(input_filepath, output_filepath)
-        if remove_source:
-            os.unlink(input_filepath)
-    return res, stdout, stderr, code, output_filepath
+                utils.make_directories(os.path.dirname(output_filepath))
+                utils.copy_file(input_filepath, output_filepath, file_hash=file_hash, strategy=CONFIG['general.copy_strategy'])
+                file_hash = None
+    if command_log_token:
+        utils.COMMAND_LOG_PATH.reset(command_log_token)
+    if member_filter_token:
+        MEMBER_FILTER.reset(member_filter_token)
+    if memory_file_token:
+        MEMORY_FILE_LIST.reset(memory_file_token)
+    if file_hash:
+        utils.update_hash(input_filepath, file_hash)
+    if hash_future:
+        hash_future.result()
+    if remove_source and selected:
+        os.unlink(input_filepath)
+    return res, stdout, stderr, code, output_filepath, backend_name
 
 def path_is_parent(parent_path, child_path):
     parent_path = os.path.abspath(parent_path)
     child_path = os.path.abspath(child_path)
     return os.path.commonpath([parent_path]) == os.path.commonpath([parent_path, child_path])
 
-def process_file_recursively(input_filepath, input_root, output_root, parent_in=None, parent_out=None, summary_file=None, remove_source=False, merge_dir=False, keep_empty_dir=False, unique=False, skip_hashing=-1, log=True):
+def run_task(work_queue, func, /, *args, **kwargs):
+    '''
+    Run func in the work queue when parallel processing is enabled, inline otherwise
+    Return the error number, always 0 for queued tasks as their errors are counted by the work queue
+    '''
+    if work_queue is None:
+        return func(*args, **kwargs)
+    work_queue.submit(func, *args, **kwargs)
+    return 0
+
+def process_file_recursively(input_filepath, *args, journal_task=None, **kwargs):
     '''
-    input_root is None if there is only 1 file to process overall'''
+    _process_file_recursively with the bookkeeping of the resume journal: a top level input file (no parent_in)
+    processed by a previous run is skipped, otherwise it starts a JournalTask shared by the files extracted from it
+    '''
+    if JOURNAL is not None and kwargs.get('parent_in') is None:
+        journal_path = os.path.abspath(input_filepath)
+        if JOURNAL.is_done(journal_path):
+            logging.debug(f'Skipping {os.path.normpath(input_filepath)}: processed by a previous run')
+            return 0
+        if kwargs.get('stat') is None:
+            kwargs['stat'] = os.stat(input_filepath)
+        journal_task = JOURNAL.begin(journal_path, stat=kwargs['stat'])
+    if journal_task is None:
+        return _process_file_recursively(input_filepath, *args, **kwargs)
+    # read by get_next_available_path to record the output paths
+    journal_task_token = CURRENT_JOURNAL_TASK.set(journal_task)
+    try:
+        error_number = _process_file_recursively(input_filepath, *args, journal_task=journal_task, **kwargs)
+    except BaseException:
+        journal_task.release(failed=True)
+        raise
+    finally:
+        CURRENT_JOURNAL_TASK.reset(journal_task_token)
+    journal_task.release()
+    return error_number
+
+def _process_file_recursively(input_filepath, input_root, output_root, parent_in=None, parent_out=None, summary_file=None, remove_source=False, merge_dir=False, keep_empty_dir=False, unique=False, skip_hashing=-1, log=True, work_queue=None, staged_dedup=False, hash_algorithms=[], stat=None, journal_task=None, memory_file=None):
+    '''
+    input_root is None if there is only 1 file to process overall
+    hash_algorithms: hashlib algorithms computed with md5, each one has its own summary column
+    stat: os.stat_result of input_filepath if already known
+    journal_task: JournalTask of the top level input file, if the run is journaled
+    memory_file: MemoryFile of input_filepath if it is an archive member held in memory, not written to disk'''
     error_number = 0
     original_filepath = input_filepath
     if parent_in and parent_out:
@@ -256,80 +914,457 @@ def process_file_recursively(input_filepath, input_root, output_root, parent_in=
     if log:
         logging.info(f'Processing {os.path.normpath(original_filepath)}')
 
-    _, filename, _, extension, mimetype = explode_filepath(input_filepath)
-    size = os.path.getsize(input_filepath)
+    if memory_file is not None:
+        _, filename, _, extension, mimetype = memory_file.explode()
+        size = len(memory_file.data)
+    else:
+        if stat is None:
+            stat = os.stat(input_filepath)
+        _, filename, _, extension, mimetype = explode_filepath(input_filepath, stat=stat)
+        size = stat.st_size
+    if FILE_FILTER is not None and not is_file_selected(os.path.normpath(original_filepath), size, mimetype):
+        logging.debug(f'File {os.path.normpath(original_filepath)} filtered out')
+        count_filtered('file')
+        if memory_file is not None:
+            memory_file.release()
+        elif path_is_parent(output_root, input_filepath):
+            os.unlink(input_filepath)
+        return error_number
     md5sum = None
-    if skip_hashing < 0 or (skip_hashing > 0 and size <= skip_hashing):
-        md5sum = utils.compute_md5sum(input_filepath)
+    # algorithm -> hex digest
+    hash_dict = {}
+    file_hash = None
+    hashing = skip_hashing < 0 or (skip_hashing > 0 and size <= skip_hashing)
+    if hashing and unique and not staged_dedup:
+        # the digest is needed before deciding to import the file
+        if memory_file is not None:
+            file_hash = utils.MultiHash(['md5'] + hash_algorithms)
+            file_hash.update(memory_file.data)
+            hash_dict = file_hash.hexdigest_dict()
+            file_hash = None
+        else:
+            hash_dict = utils.compute_hashes(input_filepath, ['md5'] + hash_algorithms)
+        md5sum = hash_dict['md5']
     
-    if unique and md5sum and md5sum in IMPORTED_FILE:
+    duplicate = False
+    candidate = None
+    memory_file_list = None
+    if unique and staged_dedup:
+        # STAGED_DEDUP has its own locks, per size group, the source can't be read again once removed
+        duplicate, candidate = STAGED_DEDUP.check(input_filepath, size, eager=remove_source)
+        if isinstance(candidate.full, bytes):
+            md5sum = candidate.full.hex()
+    elif unique and md5sum:
+        with IMPORTED_FILE_LOCK:
+            digest = bytes.fromhex(md5sum)
+            duplicate = digest in IMPORTED_FILE or md5sum in PENDING_FILE or (DIGEST_INDEX is not None and digest in DIGEST_INDEX)
+            if not duplicate:
+                PENDING_FILE.add(md5sum)
+
+    if duplicate:
         logging.warning(f'File {os.path.normpath(original_filepath)} already imported: skipping duplicate')
         res = None
         stdout = None
         stderr = None
         code = None
+        backend_name = None
         output_path = 'n/a'
-        if path_is_parent(output_root, input_filepath):
+        if memory_file is not None:
+            memory_file.release()
+        elif path_is_parent(output_root, input_filepath):
             os.unlink(input_filepath)
     else:
+        if hashing and not hash_dict:
+            # the file is hashed by process_file while being copied or extracted
+            file_hash = utils.MultiHash(['md5'] + hash_algorithms)
+        # nested archives are not kept in memory with staged dedup, which reads the files again from disk
+        memory_file_list = [] if IN_MEMORY_SIZE and not staged_dedup else None
         # res = True if input file was successfully processed, False if processing failed and None if no processing was needed
-        res, stdout, stderr, code, output_path = process_file(input_filepath, output_root, original_filepath=original_filepath, input_root=input_root, merge_dir=merge_dir, remove_source=remove_source)
+        try:
+            res, stdout, stderr, code, output_path, backend_name = process_file(input_filepath, output_root, original_filepath=original_filepath, input_root=input_root, merge_dir=merge_dir, remove_source=remove_source, file_hash=file_hash, stat=stat, memory_file=memory_file, memory_file_list=memory_file_list)
+        finally:
+            if memory_file is not None:
+                memory_file.release()
+        if file_hash:
+            hash_dict = file_hash.hexdigest_dict()
+            md5sum = hash_dict['md5']
         if res == False:
             error_number += 1
-        elif res != False and unique and md5sum:
-            IMPORTED_FILE.append(md5sum)
+        if candidate and res == False:
+            STAGED_DEDUP.discard(candidate)
+        elif unique and md5sum and not staged_dedup:
+            with IMPORTED_FILE_LOCK:
+                PENDING_FILE.discard(md5sum)
+                if res != False:
+                    IMPORTED_FILE.add(digest)
+                    if DIGEST_INDEX is not None:
+                        DIGEST_INDEX.add(digest, size=size, path=os.path.normpath(original_filepath), source=journal_task.path if journal_task else None)
     
+    # a file extracted from memory was never written
+    intermediate_path = '' if memory_file is not None and not memory_file.spilled else input_filepath
+    row = [os.path.normpath(original_filepath), intermediate_path, filename, extension, output_path, mimetype, size, '' if md5sum is None else md5sum, *[hash_dict.get(X, '') for X in hash_algorithms], code, '' if res is None else not res, stdout.strip() if not res and stdout else '', stderr.strip() if not res and stderr else '', backend_name or '']
+    # input path of the archive the file was extracted from: parent_in for the content of an extracted directory,
+    # its parent for a single decompressed file (whose own path is parent_in)
+    parent_path = None
+    if parent_in:
+        parent_path = os.path.normpath(os.path.dirname(parent_in) if parent_out == input_filepath else parent_in)
     if summary_file:
-        summary_file.writerow([os.path.normpath(original_filepath), input_filepath, filename, extension, output_path, mimetype, size, '' if md5sum is None else md5sum, code, '' if res is None else not res, stdout.strip() if not res and stdout else '', stderr.strip() if not res and stdout else ''])
+        summary_file.writerow(row, parent=parent_path)
+    if journal_task:
+        # what is needed to rebuild the summary and the duplicate detection state on resume
+        journal_task.add_row(row, parent=parent_path, file=input_filepath, size=size, md5=md5sum, imported=unique and not duplicate and res != False)
 
+    if memory_file_list and not (res and output_path and os.path.isdir(output_path)):
+        # the extraction failed: the members kept in memory are left in the output tree like the extracted ones
+        for member_file in memory_file_list:
+            member_file.spill()
     if res and output_path:
         if os.path.isdir(output_path):
-            error_number += process_directory_recursively(output_path, output_root, output_root, parent_in=original_filepath, parent_out=output_path, summary_file=summary_file, remove_source=False, merge_dir=merge_dir, keep_empty_dir=keep_empty_dir, unique=unique, skip_hashing=skip_hashing)
+            error_number += process_directory_recursively(output_path, output_root, output_root, parent_in=original_filepath, parent_out=output_path, summary_file=summary_file, remove_source=False, merge_dir=merge_dir, keep_empty_dir=keep_empty_dir, unique=unique, skip_hashing=skip_hashing, work_queue=work_queue, staged_dedup=staged_dedup, hash_algorithms=hash_algorithms, journal_task=journal_task)
+            # members kept in memory by the extraction, processed as if they had been extracted to their path
+            for member_file in memory_file_list or []:
+                if journal_task:
+                    journal_task.acquire()
+                error_number += run_task(work_queue, process_file_recursively, member_file.path, output_root, output_root, parent_in=original_filepath, parent_out=output_path, summary_file=summary_file, remove_source=False, merge_dir=merge_dir, keep_empty_dir=keep_empty_dir, unique=unique, skip_hashing=skip_hashing, log=True, work_queue=work_queue, staged_dedup=staged_dedup, hash_algorithms=hash_algorithms, journal_task=journal_task, memory_file=member_file)
         else:
             # next line won't work if there a relative path
             original_filepath = os.path.join(original_filepath, os.path.basename(output_path))
-            error_number += process_file_recursively(output_path, output_root, output_root, parent_in=original_filepath, parent_out=output_path, summary_file=summary_file, remove_source=False, merge_dir=merge_dir, keep_empty_dir=keep_empty_dir, unique=unique, skip_hashing=skip_hashing, log=True)
+            if journal_task:
+                journal_task.acquire()
+            error_number += run_task(work_queue, process_file_recursively, output_path, output_root, output_root, parent_in=original_filepath, parent_out=output_path, summary_file=summary_file, remove_source=False, merge_dir=merge_dir, keep_empty_dir=keep_empty_dir, unique=unique, skip_hashing=skip_hashing, log=True, work_queue=work_queue, staged_dedup=staged_dedup, hash_algorithms=hash_algorithms, journal_task=journal_task)
+    return error_number
+
+def process_file_batch(batch, *args, **kwargs):
+    '''
+    run process_file_recursively on a list of (filepath, os.stat_result), as a single work queue task
+    '''
+    error_number = 0
+    for filepath, stat in batch:
+        try:
+            error_number += process_file_recursively(filepath, *args, stat=stat, **kwargs)
+        except Exception:
+            logging.exception(f'Unexpected error while processing {filepath}')
+            error_number += 1
     return error_number
 
-def process_directory_recursively(input_directory, input_root, output_root, parent_in=None, parent_out=None, summary_file=None, remove_source=False, merge_dir=False, keep_empty_dir=False, unique=False, skip_hashing=-1):
+def process_directory_recursively(input_directory, input_root, output_root, parent_in=None, parent_out=None, summary_file=None, remove_source=False, merge_dir=False, keep_empty_dir=False, unique=False, skip_hashing=-1, work_queue=None, staged_dedup=False, hash_algorithms=[], journal_task=None):
     error_number = 0
-    # if input_directory is empty and keep_empty_dir flag is enabled
-    if keep_empty_dir and os.path.isdir(input_directory) and not os.listdir(input_directory):
-        relative_path = os.path.relpath(input_directory, input_root)
+    def check_empty_dir(directory):
+        # if a directory is empty and keep_empty_dir flag is enabled
+        relative_path = os.path.relpath(directory, input_root)
         output_directory = os.path.normpath(os.path.join(output_root, relative_path))
-        if os.path.exists(output_directory) and input_directory != output_directory:
-            logging.warning(f'Can not load empty directory "{input_directory}" to "{output_directory}" as destination path already exists')
-    
-    for child in os.listdir(input_directory):
-        child_path = os.path.join(input_directory, child)
-        if os.path.isdir(child_path):
-            error_number += process_directory_recursively(child_path, input_root, output_root, parent_in=parent_in, parent_out=parent_out, summary_file=summary_file, remove_source=remove_source, merge_dir=merge_dir, keep_empty_dir=keep_empty_dir, unique=unique, skip_hashing=skip_hashing)
+        if os.path.exists(output_directory) and directory != output_directory:
+            logging.warning(f'Can not load empty directory "{directory}" to "{output_directory}" as destination path already exists')
+
+    for batch in utils.walk_files(input_directory, empty_dir_callback=check_empty_dir if keep_empty_dir else None):
+        kwargs = dict(parent_in=parent_in, parent_out=parent_out, summary_file=summary_file, remove_source=remove_source, merge_dir=merge_dir, keep_empty_dir=keep_empty_dir, unique=unique, skip_hashing=skip_hashing, work_queue=work_queue, staged_dedup=staged_dedup, hash_algorithms=hash_algorithms, journal_task=journal_task)
+        if journal_task:
+            journal_task.acquire(len(batch))
+        if work_queue:
+            work_queue.submit(process_file_batch, batch, input_root, output_root, **kwargs)
         else:
-            error_number += process_file_recursively(child_path, input_root, output_root, parent_in=parent_in, parent_out=parent_out, summary_file=summary_file, remove_source=remove_source, merge_dir=merge_dir, keep_empty_dir=keep_empty_dir, unique=unique, skip_hashing=skip_hashing)
+            for filepath, stat in batch:
+                error_number += process_file_recursively(filepath, input_root, output_root, stat=stat, **kwargs)
+    return error_number
+
+def resume_target(target, output_directory, summary_file=None, unique=False, staged_dedup=False):
+    '''
+    prepare the processing of target from the journal of a previous run
+    the outputs of the top level input files whose processing was interrupted, or which were modified since, are removed
+    so they are processed again from scratch, and their digests are removed from DIGEST_INDEX. The summary rows and the
+    duplicate detection state of the other ones are restored. Files which do not exist anymore keep their outputs and their summary rows
+    '''
+    target_path = os.path.abspath(target)
+    modified_number = 0
+    for path, _ in JOURNAL.get_done_task_list():
+        if not path_is_parent(target_path, path):
+            continue
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            continue
+        if JOURNAL.is_modified(path, stat):
+            JOURNAL.forget(path)
+            modified_number += 1
+    if modified_number:
+        logging.info(f'{modified_number} input files were modified since the previous run')
+
+    for path, output_list in JOURNAL.get_interrupted_task_list():
+        if not path_is_parent(target_path, path):
+            continue
+        if not os.path.exists(path):
+            logging.warning(f'Can not process {path} again: the file does not exist anymore, its outputs are kept')
+            continue
+        logging.debug(f'Removing the outputs of {path} before processing it again')
+        if DIGEST_INDEX is not None:
+            DIGEST_INDEX.discard_source(path)
+        for output_path in output_list:
+            if not path_is_parent(output_directory, output_path) or os.path.abspath(output_path) == os.path.abspath(output_directory):
+                continue
+            if os.path.isdir(output_path) and not os.path.islink(output_path):
+                shutil.rmtree(output_path)
+            elif os.path.lexists(output_path):
+                os.unlink(output_path)
+
+    done_number = 0
+    for path, row_list in JOURNAL.get_done_task_list():
+        if not path_is_parent(target_path, path):
+            continue
+        done_number += 1
+        for event in row_list:
+            if summary_file:
+                summary_file.writerow(event['row'], parent=event.get('parent'))
+            if not event['imported']:
+                continue
+            if staged_dedup:
+                if os.path.exists(event['file']):
+                    STAGED_DEDUP.check(event['file'], event['size'])
+            elif unique and event['md5']:
+                IMPORTED_FILE.add(bytes.fromhex(event['md5']))
+    logging.info(f'{done_number} input files processed by a previous run are skipped')
+
+def get_catalog_command_dict():
+    '''
+    return {mimetype: command decompressing stdin to stdout} for the compression formats without python reader
+    '''
+    command_dict = {}
+    decompressor = get_decompressor('zst')
+    if decompressor is not None:
+        command_dict['application/zstd'] = [decompressor.path, *decompressor.argument_list]
+    return command_dict
+
+def write_catalog_row(summary_file, original_filepath, intermediate_path, mimetype, size, hash_dict, hash_algorithms, res, stderr, backend_name, parent_path):
+    basename = os.path.basename(original_filepath)
+    _, extension = split_filename(basename, mimetype)
+    code = None if res is None else int(not res)
+    row = [original_filepath, intermediate_path or '', basename, extension, '', mimetype, '' if size is None else size, hash_dict.get('md5', ''), *[hash_dict.get(X, '') for X in hash_algorithms], code, '' if res is None else not res, '', stderr.strip() if not res and stderr else '', backend_name or '']
+    if summary_file:
+        summary_file.writerow(row, parent=parent_path)
+
+def list_catalog_7z(stream, path=None):
+    '''
+    return the (name, size) of the files of a 7z or rar archive, spooled to a temporary file if it is not on disk
+    '''
+    import libs.archivestream as archivestream
+    if path is None:
+        import tempfile
+        with tempfile.NamedTemporaryFile() as fd:
+            shutil.copyfileobj(stream, fd, archivestream.READ_SIZE)
+            fd.flush()
+            member_list = list_7z(fd.name)
+    else:
+        member_list = list_7z(path)
+    if member_list is None:
+        raise OSError(f'{CONFIG["bin.sevenz"]} can not list the archive')
+    return member_list
+
+def get_catalog_reader(mimetype):
+    '''
+    return the name of what reads an archive of mimetype in catalog mode, for the Backend column
+    '''
+    if mimetype in ['application/x-7z-compressed', 'application/x-rar-compressed']:
+        return '7z'
+    command_dict = get_catalog_command_dict()
+    if mimetype in command_dict:
+        return os.path.basename(command_dict[mimetype][0])
+    return 'native'
+
+def catalog_members(stream, original_filepath, mimetype, summary_file, path=None, skip_hashing=-1, hash_algorithms=[]):
+    '''
+    write the summary rows of the members of the archive read from stream, recursively
+    path: path of the archive if it is a file on disk, zip and 7z archives not on disk are spooled
+    return the error number
+    errors of the archive itself are raised (archivestream.ARCHIVE_ERROR_LIST), the ones of its members are counted
+    '''
+    import tarfile
+    import libs.archivestream as archivestream
+    member_filter = get_member_filter(original_filepath) if FILE_FILTER is not None else None
+    kwargs = dict(skip_hashing=skip_hashing, hash_algorithms=hash_algorithms)
+    def catalog_member_list(member_iterator):
+        error_number = 0
+        for member in member_iterator:
+            if member_filter is not None and not member_filter(member.name, member.size):
+                continue
+            member_path = os.path.join(original_filepath, member.name)
+            try:
+                member_stream = member.open()
+            except archivestream.ARCHIVE_ERROR_LIST as e:
+                # encrypted zip member...: the next members can still be read
+                logging.error(f'Can not read {member_path}: {e}')
+                write_catalog_row(summary_file, member_path, None, '', member.size, {}, hash_algorithms, False, str(e), None, original_filepath)
+                error_number += 1
+                continue
+            with contextlib.closing(member_stream):
+                error_number += catalog_stream(member_stream, member_path, summary_file, parent_path=original_filepath, size=member.size, **kwargs)
+        return error_number
+
+    if mimetype in ['application/x-tar', 'application/x-gtar', 'application/x-bzip2']:
+        # bzip2 files are extracted as compressed tar archives, as extract_bz2 does
+        return catalog_member_list(archivestream.iter_tar(stream))
+    if mimetype == 'application/zip':
+        return catalog_member_list(archivestream.iter_zip(stream, path=path))
+    if mimetype in ['application/x-7z-compressed', 'application/x-rar-compressed']:
+        # 7z can not read an archive from a stream: members are listed only, without mimetype nor digest
+        for name, size in list_catalog_7z(stream, path=path):
+            if member_filter is None or member_filter(name, size):
+                write_catalog_row(summary_file, os.path.join(original_filepath, name), None, '', size, {}, hash_algorithms, None, None, None, original_filepath)
+        return 0
+    with contextlib.closing(archivestream.open_decompressed(mimetype, stream, get_catalog_command_dict())) as decompressed:
+        header = decompressed.read(tarfile.BLOCKSIZE)
+        content = utils.PrefixedStream(header, decompressed)
+        if CONFIG['backend.stream_tar'] and is_tar_header(header):
+            # listed as the members of the compressed file, as stream_to_output extracts them
+            error_number = catalog_member_list(archivestream.iter_tar(content, mode='r|'))
+        else:
+            filename, _ = split_filename(os.path.basename(original_filepath), mimetype)
+            member_path = os.path.join(original_filepath, filename)
+            if member_filter is not None and not member_filter(filename, None):
+                return 0
+            error_number = catalog_stream(content, member_path, summary_file, parent_path=original_filepath, **kwargs)
+        # read up to the end of the stream so the decompressor checks it
+        while decompressed.read(archivestream.READ_SIZE):
+            pass
     return error_number
 
-def process_target(target, output_directory=None, summary_filepath=None, remove_source=False, merge_dir=False, keep_empty_dir=False, unique=False, skip_hashing=-1):
+def catalog_stream(stream, original_filepath, summary_file, parent_path=None, size=None, mimetype=None, path=None, skip_hashing=-1, hash_algorithms=[]):
+    '''
+    write the summary row of the file read from stream, after the ones of its members if it is an archive, without
+    writing anything to disk: the members are read from the archive stream, the digest is computed on the way
+    size: size given by the archive headers, checked against --skip-hashing
+    mimetype: mimetype of the file if already known, path: path of the file if it is on disk
+    return the error number
+    '''
+    import libs.archivestream as archivestream
+    error_number = 0
+    hashing = skip_hashing < 0 or (skip_hashing > 0 and size is not None and size <= skip_hashing)
+    file_hash = utils.MultiHash(['md5'] + hash_algorithms) if hashing else None
+    counting_stream = archivestream.CountingStream(stream, file_hash)
+    res = None
+    stderr = None
+    backend_name = None
+    read_error = False
+    try:
+        header = counting_stream.read(magic.BYTES_MAX)
+        if mimetype is None:
+            mimetype = identify_buffer(header)
+        if FILE_FILTER is not None and not is_file_selected(original_filepath, size, mimetype):
+            logging.debug(f'File {original_filepath} filtered out')
+            count_filtered('file')
+            return error_number
+        if mimetype in EXTRACTED_MIMETYPE_LIST:
+            backend_name = get_catalog_reader(mimetype)
+            try:
+                error_number += catalog_members(utils.PrefixedStream(header, counting_stream), original_filepath, mimetype, summary_file, path=path, skip_hashing=skip_hashing, hash_algorithms=hash_algorithms)
+                res = True
+            except archivestream.ARCHIVE_ERROR_LIST as e:
+                logging.error(f'Can not read {original_filepath}: {e}')
+                res = False
+                stderr = str(e)
+        counting_stream.drain()
+    except archivestream.ARCHIVE_ERROR_LIST as e:
+        # the archive this file is read from is corrupted or truncated
+        logging.error(f'Can not read {original_filepath}: {e}')
+        res = False
+        stderr = str(e)
+        mimetype = mimetype or ''
+        read_error = True
+    else:
+        size = counting_stream.size
+    if res == False:
+        error_number += 1
+    hash_dict = file_hash.hexdigest_dict() if file_hash and not read_error else {}
+    write_catalog_row(summary_file, original_filepath, path, mimetype, size, hash_dict, hash_algorithms, res, stderr, backend_name, parent_path)
+    return error_number
+
+def catalog_file(filepath, stat=None, summary_file=None, **kwargs):
+    '''
+    catalog_stream for a file on disk, the ones extracted by 7z and unrar are listed from the file itself
+    '''
+    logging.info(f'Cataloging {os.path.normpath(filepath)}')
+    if stat is None:
+        stat = os.stat(filepath)
+    _, _, _, _, mimetype = explode_filepath(filepath, stat=stat)
+    if not S_ISREG(stat.st_mode):
+        write_catalog_row(summary_file, os.path.normpath(filepath), filepath, mimetype, stat.st_size, {}, kwargs.get('hash_algorithms', []), None, None, None, None)
+        return 0
+    with open(filepath, 'rb') as fd:
+        return catalog_stream(fd, os.path.normpath(filepath), summary_file, size=stat.st_size, mimetype=mimetype, path=filepath, **kwargs)
+
+def catalog_file_batch(batch, **kwargs):
+    '''
+    run catalog_file on a list of (filepath, os.stat_result), as a single work queue task
+    '''
+    error_number = 0
+    for filepath, stat in batch:
+        try:
+            error_number += catalog_file(filepath, stat=stat, **kwargs)
+        except Exception:
+            logging.exception(f'Unexpected error while cataloging {filepath}')
+            error_number += 1
+    return error_number
+
+def catalog_target(target, summary_file=None, skip_hashing=-1, work_queue=None, hash_algorithms=[]):
+    '''
+    catalog the files of target and the members of its archives, recursively, without extracting them
+    '''
+    kwargs = dict(summary_file=summary_file, skip_hashing=skip_hashing, hash_algorithms=hash_algorithms)
+    if os.path.isfile(target):
+        return catalog_file_batch([(target, os.stat(target))], **kwargs)
+    error_number = 0
+    for batch in utils.walk_files(target):
+        error_number += run_task(work_queue, catalog_file_batch, batch, **kwargs)
+    return error_number
+
+def process_target(target, output_directory=None, summary_filepath=None, remove_source=False, merge_dir=False, keep_empty_dir=False, unique=False, skip_hashing=-1, jobs=1, staged_dedup=False, hash_algorithms=[], resume=False, summary_database=None, catalog=False):
+    '''
+    summary_database: SummaryDatabase receiving the summary rows instead of the CSV file at summary_filepath
+    catalog: only write the summary, archives are read as streams and nothing is extracted (no output directory)
+    '''
     global CONFIG
 
     error_number = 0
 
     timestamp = datetime.now().strftime('%Y-%m-%d_%H%M%S')
-    if not output_directory:
+    if catalog:
+        output_directory = None
+    elif not output_directory:
         output_directory = f'extracted_{timestamp}'
-    if not os.path.exists(output_directory):
+    if output_directory and not os.path.exists(output_directory):
         os.makedirs(output_directory)
     
-    if not summary_filepath:
+    if summary_database is not None:
+        summary_filepath = summary_database.path
+    elif not summary_filepath:
         summary_filepath = f'summary_{timestamp}.csv'
     
-    with open(summary_filepath, 'w') as fd:
-        summary_file = csv.writer(fd, delimiter=',')
-        summary_file.writerow(['Input Full Path', 'Intermediate Full Path', 'Input File Name', 'Input File Extension', 'Output Full Path', 'Mime Type', 'Size', 'MD5', 'Code', 'Error', 'Stdout', 'Stderr'])
+    # with a single job, everything runs in the main thread as before
+    work_queue = None
+    if jobs > 1:
+        work_queue = utils.WorkQueue(jobs)
 
-        if os.path.isfile(target):
-            error_number += process_file_recursively(target, None, output_directory, summary_file=summary_file, remove_source=remove_source, merge_dir=merge_dir, keep_empty_dir=keep_empty_dir, unique=unique, skip_hashing=skip_hashing)
+    header = ['Input Full Path', 'Intermediate Full Path', 'Input File Name', 'Input File Extension', 'Output Full Path', 'Mime Type', 'Size', 'MD5', *[X.upper() for X in hash_algorithms], 'Code', 'Error', 'Stdout', 'Stderr', 'Backend']
+    with open(summary_filepath, 'w') if summary_database is None else contextlib.nullcontext() as fd:
+        if summary_database is None:
+            summary_file = utils.SummaryWriter(fd, delimiter=',')
+            summary_file.writerow(header)
         else:
-            error_number += process_directory_recursively(target, target, output_directory, summary_file=summary_file, remove_source=remove_source, merge_dir=merge_dir, keep_empty_dir=keep_empty_dir, unique=unique, skip_hashing=skip_hashing)
+            summary_file = summary_database
+            summary_database.create_table(header)
+        if JOURNAL is not None:
+            if resume:
+                resume_target(target, output_directory, summary_file=summary_file, unique=unique, staged_dedup=staged_dedup)
+            JOURNAL.add_run(target=os.path.abspath(target), output=output_directory, summary=summary_filepath, summary_db=summary_database is not None, hash_algorithms=hash_algorithms)
+
+        if catalog:
+            error_number += catalog_target(target, summary_file=summary_file, skip_hashing=skip_hashing, work_queue=work_queue, hash_algorithms=hash_algorithms)
+        elif os.path.isfile(target):
+            error_number += process_file_recursively(target, None, output_directory, summary_file=summary_file, remove_source=remove_source, merge_dir=merge_dir, keep_empty_dir=keep_empty_dir, unique=unique, skip_hashing=skip_hashing, work_queue=work_queue, staged_dedup=staged_dedup, hash_algorithms=hash_algorithms)
+        else:
+            error_number += process_directory_recursively(target, target, output_directory, summary_file=summary_file, remove_source=remove_source, merge_dir=merge_dir, keep_empty_dir=keep_empty_dir, unique=unique, skip_hashing=skip_hashing, work_queue=work_queue, staged_dedup=staged_dedup, hash_algorithms=hash_algorithms)
+
+        if work_queue:
+            error_number += work_queue.join()
+            work_queue.shutdown()
     return output_directory, summary_filepath, error_number
     
 def check_config():
@@ -342,6 +1377,36 @@ def check_config():
             res = False
     return res
 
+def print_startup_profile(module_number=25):
+    '''
+    print the import time of the modules loaded by the extractor, measured in a new interpreter with python -X importtime,
+    and the time taken by the resources loaded on first use (libmagic and its database, mimetype table)
+    '''
+    import subprocess
+    process = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import extractor'], cwd=CONFIG.PROJECT_DIR, capture_output=True, text=True)
+    module_list = []
+    total = 0
+    for line in process.stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        self_time, cumulative_time, name = line[len('import time:'):].split('|')
+        module_list.append((int(cumulative_time), int(self_time), name.rstrip()))
+        if not name.startswith('  '):
+            total += int(cumulative_time)
+    print(f'{"cumulative (ms)":>16} {"self (ms)":>10}  module')
+    for cumulative_time, self_time, name in sorted(module_list, reverse=True)[:module_number]:
+        print(f'{cumulative_time / 1000:>16.1f} {self_time / 1000:>10.1f} {name}')
+    print(f'{total / 1000:>16.1f} {"":>10}  total import time ({len(module_list)} modules)')
+    start = time.perf_counter()
+    magic.from_buffer(b'', mime=True)
+    libmagic_time = time.perf_counter() - start
+    start = time.perf_counter()
+    get_mimetype_table()
+    table_time = time.perf_counter() - start
+    print(f'{libmagic_time * 1000:>16.1f} {"":>10}  libmagic load on first use')
+    print(f'{table_time * 1000:>16.1f} {"":>10}  mimetype table load on first use')
+
 if __name__ == '__main__':
     # Parse commmand line arguments
     parser = argparse.ArgumentParser()
@@ -354,12 +1419,39 @@ if __name__ == '__main__':
     # merge feature is unsecure at this time - do not use
     # parser.add_argument('-m', '--merge_dir', action='store_true', help='Merge directory in case of name conflict')
     parser.add_argument('-s', '--summary', help='Summary file path')
+    parser.add_argument('--summary-db', help='Write the summary to this SQLite database instead of a CSV file, with the archive each file was extracted from and indexes on MD5, mimetype, output path and parent archive')
     parser.add_argument('-S', '--skip-binary-check', action='store_true', help='Skip binary check')
     parser.add_argument('-H', '--skip-hashing', default=-1, type=int, help='Skip file hashing for file bigger than value provided (in bytes). If set to 0, skip hashing for all files. All file will be hashed if set to a negative value.')
+    parser.add_argument('-A', '--hash-algorithms', default='', help='Comma separated hash algorithms computed in the same pass as MD5, each one gets a summary column (e.g. sha1,sha256)')
     parser.add_argument('-u', '--unique', action='store_true', help='Don\'t import duplicated files')
-    parser.add_argument('input', nargs='+', help='File or folder to import')
+    parser.add_argument('-D', '--staged-dedup', action='store_true', help='With --unique, only hash files sharing their size with another file: first and last blocks, then the whole content if they still match. Can be used with --skip-hashing')
+    parser.add_argument('-j', '--jobs', default=1, type=int, help='Number of files processed in parallel (identification, hashing, extraction and recursion into nested archives)')
+    parser.add_argument('-I', '--index', help='Persistent digest index (SQLite) used by --unique to skip files imported by previous runs')
+    parser.add_argument('--compact-index', action='store_true', help='Compact the digest index provided with --index and exit')
+    parser.add_argument('--include', action='append', default=[], metavar='GLOB', help='Only process the files matching this glob, matched against the file name, or against the path if it contains a /. Repeatable. Archive members are selected before being extracted')
+    parser.add_argument('--exclude', action='append', default=[], metavar='GLOB', help='Do not process the files matching this glob, archives included. Repeatable')
+    parser.add_argument('--include-mimetype', action='append', default=[], metavar='MIMETYPE', help='Only process the files of this mimetype (glob: image/*), checked once a file is extracted. Repeatable')
+    parser.add_argument('--exclude-mimetype', action='append', default=[], metavar='MIMETYPE', help='Do not process the files of this mimetype (glob: video/*), archives included. Repeatable')
+    parser.add_argument('--min-size', type=parse_size, help='Do not process the files smaller than this size (10K, 5M, 1G...), archives excepted')
+    parser.add_argument('--max-size', type=parse_size, help='Do not process the files bigger than this size (10K, 5M, 1G...), archives excepted')
+    parser.add_argument('--adaptive', action='store_true', help='Tune the number of extractions running at once, between 1 and --jobs, from the throughput, the iowait and the memory usage, within the cgroup CPU and memory limits')
+    parser.add_argument('--max-processes', type=int, help='Maximum number of external extraction commands (tar, 7z, unzip, zstd...) running at once, default: number of CPUs')
+    parser.add_argument('--in-memory-size', type=parse_size, default=0, help='Keep the archive members up to this size (64K, 1M...) named like an archive in memory and extract them from there, without writing them to the output tree: only their content is written. Members which can not be extracted from memory are written out. Natively extracted tar, zip, gz, bz2 and xz archives only, not used with --staged-dedup')
+    parser.add_argument('--in-memory-limit', type=parse_size, help='Bytes of archive members kept in memory at once by --in-memory-size over the whole run, the next members are written out. Default: the larger of 256M and 16 times --in-memory-size')
+    parser.add_argument('--command-log', help='Append the whole output of the external extraction commands to a log file per archive in this directory, only its end is kept in the summary')
+    parser.add_argument('--catalog', action='store_true', help='Only write the summary of the files and of the members of their archives, recursively, without extracting anything: archives are read as streams (7z and rar archives are listed only, their members have no mimetype nor digest)')
+    parser.add_argument('-J', '--journal', help='Journal file recording the progress of the run, to resume it with --resume if it is interrupted')
+    parser.add_argument('-r', '--resume', action='store_true', help='Resume the run recorded in the journal provided with --journal: processed files are skipped, interrupted ones are processed again and the summary is rebuilt. Output and summary paths default to the ones of the journaled run')
+    parser.add_argument('-M', '--manifest', help='Incremental mode: manifest of the files processed by the previous runs, created if needed. Files whose path, size, modification time and inode did not change are skipped, the outputs of modified ones are replaced, and the summary covers all of them. Same as --journal MANIFEST --resume, with the manifest compacted at the end of the run')
+    parser.add_argument('--startup-profile', action='store_true', help='Print the import time of each module and the time taken by the resources loaded on first use, then exit')
+    parser.add_argument('input', nargs='*', help='File or folder to import')
 
     args = parser.parse_args()
+    if args.startup_profile:
+        print_startup_profile()
+        sys.exit(0)
+    if not args.input and not args.compact_index:
+        parser.error('the following arguments are required: input')
 
     # Init config
     if args.config is not None and os.path.exists(args.config):
@@ -376,21 +1468,136 @@ if __name__ == '__main__':
     else:
         init_logging(CONFIG['general.log_directory'], level=logging.INFO)
 
-    if args.unique and args.skip_hashing:
-        logging.error('Argument --unique and --skip-hashing can\t be used together')
+    hash_algorithms = [X.strip().lower() for X in args.hash_algorithms.split(',') if X.strip()]
+    for algorithm in hash_algorithms:
+        # shake algorithms need a digest length
+        if algorithm not in hashlib.algorithms_available or algorithm.startswith('shake'):
+            logging.error(f'Unsupported hash algorithm {algorithm}')
+            sys.exit(1)
+    hash_algorithms = [X for X in dict.fromkeys(hash_algorithms) if X != 'md5']
+
+    if args.unique and args.skip_hashing >= 0 and not args.staged_dedup:
+        logging.error('Argument --unique and --skip-hashing can\'t be used together without --staged-dedup')
+        sys.exit(1)
+
+    if args.staged_dedup and not args.unique:
+        logging.error('Argument --staged-dedup requires --unique')
+        sys.exit(1)
+
+    if args.staged_dedup and args.index:
+        # files with a unique size are never hashed, so they could not be recorded in the index
+        logging.error('Argument --staged-dedup and --index can\'t be used together')
         sys.exit(1)
     
+    if args.compact_index:
+        if not args.index:
+            logging.error('Argument --compact-index requires --index')
+            sys.exit(1)
+        index = DigestIndex(args.index)
+        index.compact()
+        logging.info(f'Digest index {args.index} compacted: {len(index)} digests')
+        index.close()
+        sys.exit(0)
+
+    if args.index and not args.unique:
+        logging.error('Argument --index requires --unique')
+        sys.exit(1)
+
+    if args.manifest:
+        if args.journal:
+            logging.error('Argument --manifest and --journal can\'t be used together')
+            sys.exit(1)
+        args.journal = args.manifest
+        args.resume = True
+
+    if args.catalog and (args.journal or args.unique):
+        logging.error('Argument --catalog can\'t be used with --journal, --manifest nor --unique')
+        sys.exit(1)
+
+    if args.resume and not args.journal:
+        logging.error('Argument --resume requires --journal')
+        sys.exit(1)
+
+    if args.journal and not args.resume and os.path.exists(args.journal) and os.path.getsize(args.journal):
+        logging.error(f'Journal {args.journal} already exists: use --resume to resume its run or remove it')
+        sys.exit(1)
+
     if not args.skip_binary_check and not check_config():
         sys.exit(1)
 
+    if args.index:
+        DIGEST_INDEX = DigestIndex(args.index)
+
+    if args.max_processes is not None:
+        if args.max_processes < 1:
+            logging.error('Argument --max-processes must be at least 1')
+            sys.exit(1)
+        utils.COMMAND_RUNNER.max_process = args.max_processes
+
+    if args.adaptive:
+        SCHEDULER = AdaptiveScheduler(args.jobs)
+        memory_limit = 'unknown' if SCHEDULER.memory_limit is None else f'{SCHEDULER.memory_limit / 1024 / 1024:.0f} MiB'
+        logging.info(f'Adaptive extraction concurrency: up to {args.jobs} extractions, {SCHEDULER.cpu_limit} CPUs, {memory_limit} of memory')
+
+    if args.include or args.exclude or args.include_mimetype or args.exclude_mimetype or args.min_size is not None or args.max_size is not None:
+        FILE_FILTER = FileFilter(include_list=args.include, exclude_list=args.exclude, mimetype_include_list=args.include_mimetype, mimetype_exclude_list=args.exclude_mimetype, min_size=args.min_size, max_size=args.max_size)
+
+    if args.command_log:
+        COMMAND_LOG_DIRECTORY = os.path.abspath(args.command_log)
+
+    IN_MEMORY_SIZE = args.in_memory_size
+    IN_MEMORY_LIMIT = args.in_memory_limit if args.in_memory_limit is not None else max(IN_MEMORY_LIMIT, 16 * IN_MEMORY_SIZE)
+
+    if args.summary and args.summary_db:
+        logging.error('Argument --summary and --summary-db can\'t be used together')
+        sys.exit(1)
+
+    if args.journal:
+        JOURNAL = Journal(args.journal)
+        if args.resume and JOURNAL.run_list:
+            last_run = JOURNAL.run_list[-1]
+            if last_run['hash_algorithms'] != hash_algorithms:
+                # the summary rows of the previous run would not have the same columns
+                logging.error(f'The journaled run used --hash-algorithms "{",".join(last_run["hash_algorithms"])}", the same ones are required to resume it')
+                sys.exit(1)
+            args.output = args.output or last_run['output']
+            if last_run.get('summary_db'):
+                args.summary_db = args.summary_db or last_run['summary']
+            elif not args.summary_db:
+                args.summary = args.summary or last_run['summary']
+
+    summary_database = None
+    if args.summary_db:
+        summary_database = SummaryDatabase(args.summary_db)
+
     error_number = 0
-    for target in args.input:
-        logging.info(f'Loading evidence from {target}')
-        output_directory, summary_filepath, target_error_number = process_target(target, output_directory=args.output, summary_filepath=args.summary, keep_empty_dir=args.keep_empty_dir, unique=args.unique, skip_hashing=args.skip_hashing)
-        error_number += target_error_number
-    logging.info(f'Evidence loaded to {output_directory}')
+    try:
+        for target in args.input:
+            logging.info(f'Loading evidence from {target}')
+            output_directory, summary_filepath, target_error_number = process_target(target, output_directory=args.output, summary_filepath=args.summary, keep_empty_dir=args.keep_empty_dir, unique=args.unique, skip_hashing=args.skip_hashing, jobs=args.jobs, staged_dedup=args.staged_dedup, hash_algorithms=hash_algorithms, resume=args.resume, summary_database=summary_database, catalog=args.catalog)
+            error_number += target_error_number
+        if args.manifest:
+            JOURNAL.compact()
+    finally:
+        if DIGEST_INDEX is not None:
+            DIGEST_INDEX.close()
+        if JOURNAL is not None:
+            JOURNAL.close()
+        if summary_database is not None:
+            summary_database.close()
+    if output_directory:
+        logging.info(f'Evidence loaded to {output_directory}')
     if summary_filepath:
         logging.info(f'Summary written to {summary_filepath}')
+    logging.info(f'{IDENTIFY_COUNT["signature"]} files identified by signature, {IDENTIFY_COUNT["libmagic"]} by libmagic')
+    if FILE_FILTER is not None:
+        logging.info(f'{FILTERED_COUNT["file"]} files filtered out, {FILTERED_COUNT["member"]} archive members not extracted')
+    if SCHEDULER is not None:
+        logging.info(f'Concurrent extraction limit went from {SCHEDULER.lowest_limit} to {SCHEDULER.highest_limit}, ended at {SCHEDULER.limit}')
+    if args.staged_dedup:
+        logging.info(f'Staged dedup: {STAGED_DEDUP.file_number} files checked, {STAGED_DEDUP.partial_number} partially hashed, {STAGED_DEDUP.full_number} fully hashed')
+    elif args.unique:
+        logging.info(f'{len(IMPORTED_FILE)} unique files imported, dedup index memory: {IMPORTED_FILE.memory_usage() / 1024 / 1024:.1f} MiB')
     if error_number:
         logging.error(f'{error_number} occured during processing')
 
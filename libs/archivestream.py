@@ -0,0 +1,160 @@
+import bz2
+import gzip
+import lzma
+import subprocess
+import tarfile
+import tempfile
+import threading
+import zipfile
+import zlib
+
+__version__='1.0'
+
+READ_SIZE = 1024 * 1024
+# zip archives need random access: a zip read from a non seekable stream is spooled in memory up to this size,
+# in a temporary file beyond
+SPOOL_SIZE = 64 * 1024 * 1024
+
+# errors raised by the readers on corrupted, truncated or unsupported archives: zlib.error for a corrupt deflate
+# stream, RuntimeError for an encrypted zip member, NotImplementedError for an unsupported zip compression method
+ARCHIVE_ERROR_LIST = (tarfile.TarError, zipfile.BadZipFile, lzma.LZMAError, zlib.error, EOFError, OSError, ValueError, RuntimeError, NotImplementedError)
+
+class CountingStream:
+    '''
+    Read-only stream counting the bytes read from stream and feeding them to file_hash (hashlib-like, optional)
+    '''
+    def __init__(self, stream, file_hash=None):
+        self.stream = stream
+        self.file_hash = file_hash
+        self.size = 0
+
+    def read(self, size=-1):
+        data = self.stream.read(size)
+        self.size += len(data)
+        if self.file_hash is not None:
+            self.file_hash.update(data)
+        return data
+
+    def drain(self):
+        '''
+        read the rest of the stream, so size and file_hash cover all of it
+        '''
+        while self.read(READ_SIZE):
+            pass
+
+class CommandDecompressor:
+    '''
+    Stream decompressed by an external command (zstd -d -c...) which reads stream from its stdin
+    stream is written to the command by a thread of its own, read() raises OSError if the command fails
+    '''
+    def __init__(self, command, stream):
+        self.command = command
+        self.stream = stream
+        self.error = None
+        self.stderr_fd = tempfile.TemporaryFile()
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=self.stderr_fd)
+        self.thread = threading.Thread(target=self._feed, daemon=True)
+        self.thread.start()
+
+    def _feed(self):
+        try:
+            while data := self.stream.read(READ_SIZE):
+                self.process.stdin.write(data)
+        except BrokenPipeError:
+            # the command stopped reading, read() reports its exit code
+            pass
+        except Exception as e:
+            self.error = e
+        finally:
+            try:
+                self.process.stdin.close()
+            except BrokenPipeError:
+                pass
+
+    def read(self, size=-1):
+        data = self.process.stdout.read(size)
+        if not data and (size is None or size != 0):
+            self._check()
+        return data
+
+    def _check(self):
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+        if self.process.wait() != 0:
+            self.stderr_fd.seek(0)
+            stderr = self.stderr_fd.read().decode(errors='replace').strip()
+            raise OSError(f'{self.command[0]} exited with code {self.process.returncode}: {stderr}')
+
+    def close(self):
+        if self.process.poll() is None:
+            self.process.kill()
+        self.process.stdout.close()
+        self.process.wait()
+        self.thread.join()
+        self.stderr_fd.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
+
+class ArchiveMember:
+    '''
+    File of an archive: name (path inside the archive), size (bytes, from the archive headers) and open(), which
+    returns its content as a stream. A member can only be opened before the next one is read
+    '''
+    def __init__(self, name, size, opener):
+        self.name = name
+        self.size = size
+        self.opener = opener
+
+    def open(self):
+        return self.opener()
+
+def open_decompressed(mimetype, stream, command_dict={}):
+    '''
+    return the decompressed content of stream for a compression format (gzip, bzip2, xz)
+    command_dict maps other mimetypes to a command decompressing stdin to stdout, run by CommandDecompressor
+    '''
+    if mimetype == 'application/gzip':
+        return gzip.GzipFile(fileobj=stream, mode='rb')
+    if mimetype == 'application/x-bzip2':
+        return bz2.BZ2File(stream, 'rb')
+    if mimetype == 'application/x-xz':
+        return lzma.LZMAFile(stream, 'rb')
+    if mimetype in command_dict:
+        return CommandDecompressor(command_dict[mimetype], stream)
+    raise ValueError(f'Unsupported compression format: {mimetype}')
+
+def iter_tar(stream, mode='r|*'):
+    '''
+    yield the ArchiveMember of the regular files of a tar archive read sequentially from stream
+    mode 'r|*' also reads a tar compressed with gzip, bzip2 or xz, 'r|' only an uncompressed one
+    '''
+    with tarfile.open(fileobj=stream, mode=mode) as tar:
+        for member in tar:
+            if member.isfile():
+                yield ArchiveMember(member.name, member.size, lambda member=member: tar.extractfile(member))
+
+def iter_zip(stream=None, path=None):
+    '''
+    yield the ArchiveMember of the files of a zip archive at path, or read from stream (spooled if not seekable)
+    '''
+    spool = None
+    if path is None and not (hasattr(stream, 'seekable') and stream.seekable()):
+        spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+        while data := stream.read(READ_SIZE):
+            spool.write(data)
+        spool.seek(0)
+        stream = spool
+    try:
+        with zipfile.ZipFile(path or stream) as archive:
+            for info in archive.infolist():
+                if not info.is_dir():
+                    yield ArchiveMember(info.filename, info.file_size, lambda info=info: archive.open(info))
+    finally:
+        if spool is not None:
+            spool.close()
@@ -1,8 +1,6 @@
 import os
 import sys
 import json
-import inspect
-import traceback
 import configparser
 
 __version__='1.2'
@@ -146,7 +144,7 @@ class Config():
         if definition is None:
             for attr_name in dir(self):
                 attr = getattr(self, attr_name)
-                if inspect.isclass(attr) and not attr_name.startswith('_'):
+                if isinstance(attr, type) and not attr_name.startswith('_'):
                     section_name = attr_name.lower()
                     section_comment = None
                     field_dict = {}
@@ -162,7 +160,7 @@ class Config():
             if '__comment__' in dir(definition):
                 self.comment = definition.__comment__
             for attr_name, attr in definition.__dict__.items():
-                if inspect.isclass(attr) and not attr_name.startswith('_'):
+                if isinstance(attr, type) and not attr_name.startswith('_'):
                     section_name = attr_name.lower()
                     section_comment = None
                     field_dict = {}
@@ -278,6 +276,7 @@ class Config():
                     self.parse_field(section.name, key, field)
                 except Exception as e:
                     print(f'Error while parsing configuration field {section.name}.{key} in {self.config_path}')
+                    import traceback
                     traceback.print_exc()
                     sys.exit()
 
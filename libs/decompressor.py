@@ -0,0 +1,79 @@
+import os
+import shlex
+import shutil
+import threading
+
+__version__='1.0'
+
+class Decompressor:
+    '''
+    External decompression tool, run as: path *argument_list filepath, decompressing filepath to stdout
+    threaded tools use several cores to decompress a single file
+    '''
+    def __init__(self, name, argument_list=['-d', '-c'], threaded=False, path=None):
+        self.name = name
+        self.argument_list = argument_list
+        self.threaded = threaded
+        self.path = path
+
+    def bind(self, path):
+        '''
+        return a copy of the tool installed at path
+        '''
+        return Decompressor(self.name, argument_list=self.argument_list, threaded=self.threaded, path=path)
+
+    def get_command(self, filepath):
+        return [self.path, *self.argument_list, filepath]
+
+    def get_program(self):
+        '''
+        return the program for tar --use-compress-program, which adds -d itself
+        '''
+        return shlex.join([self.path, *[X for X in self.argument_list if X not in ['-d', '-c']]])
+
+# candidate tools of each format, fastest first
+DECOMPRESSOR_DICT = {
+    # pigz inflates on one core but reads, writes and checks the stream in other threads
+    'gz': [Decompressor('pigz', threaded=True), Decompressor('gzip')],
+    'bz2': [Decompressor('lbzip2', threaded=True), Decompressor('pbzip2', threaded=True), Decompressor('bzip2')],
+    # xz decompresses multi-block files in parallel since 5.4, -T0 is ignored by older versions
+    'xz': [Decompressor('xz', ['-d', '-c', '-T0'], threaded=True)],
+    'zst': [Decompressor('zstd', ['-d', '-c', '-T0'])],
+}
+
+class DecompressorRegistry:
+    '''
+    Find the fastest installed decompression tool of each format
+    A tool is looked up at the path given for its name in path_dict, then in PATH
+    '''
+    def __init__(self, decompressor_dict=DECOMPRESSOR_DICT, path_dict={}):
+        self.decompressor_dict = decompressor_dict
+        self.path_dict = path_dict
+        self.cache = {}
+        self.lock = threading.Lock()
+
+    def get_path(self, name):
+        path = self.path_dict.get(name)
+        if path and os.path.isfile(path) and os.access(path, os.X_OK):
+            return path
+        return shutil.which(name)
+
+    def find(self, format):
+        '''
+        return the first available Decompressor of format bound to its path, None if none is installed
+        '''
+        with self.lock:
+            if format not in self.cache:
+                self.cache[format] = None
+                for decompressor in self.decompressor_dict.get(format, []):
+                    path = self.get_path(decompressor.name)
+                    if path:
+                        self.cache[format] = decompressor.bind(path)
+                        break
+            return self.cache[format]
+
+    def get_available_list(self):
+        '''
+        return the (format, Decompressor) of the tools selected for every format
+        '''
+        return [(X, self.find(X)) for X in self.decompressor_dict]
@@ -0,0 +1,127 @@
+import hashlib
+import logging
+import os
+import threading
+
+__version__='1.0'
+
+class Candidate:
+    __slots__ = ('path', 'size', 'partial', 'full')
+
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+        self.partial = None
+        self.full = None
+
+class StagedDeduplicator:
+    '''
+    Duplicate detection in stages: size, then hash of the first and last blocks, then hash of the whole content
+    A file is only read when a file seen before has the same size (then the same partial hash), and the file seen
+    before is hashed lazily at that time. Files with a unique size are never read
+    The paths given to check() must stay readable until the end of the run, unless eager is set
+    Thread safe: the files of a size group are checked one at a time, under one of lock_number locks picked by size,
+    so hashing a big file does not hold back the checks of the other sizes
+    '''
+    def __init__(self, block_size=64 * 1024, algorithm='md5', lock_number=64):
+        self.block_size = block_size
+        self.algorithm = algorithm
+        self.lock_list = [threading.Lock() for _ in range(lock_number)]
+        self.counter_lock = threading.Lock()
+        # size -> Candidate if only one file has this size, else partial digest -> Candidate if only one file
+        # has this partial digest, else full digest -> Candidate
+        self.by_size = {}
+        self.file_number = 0
+        self.partial_number = 0
+        self.full_number = 0
+
+    def _read_hash(self, candidate, partial):
+        file_hash = hashlib.new(self.algorithm)
+        try:
+            with open(candidate.path, 'rb') as fd:
+                if partial and candidate.size > 2 * self.block_size:
+                    file_hash.update(fd.read(self.block_size))
+                    fd.seek(-self.block_size, os.SEEK_END)
+                    file_hash.update(fd.read(self.block_size))
+                else:
+                    while chunk := fd.read(1024 * 1024):
+                        file_hash.update(chunk)
+        except OSError as e:
+            logging.warning(f'Can not hash {candidate.path} for duplicate detection: {e}')
+            # never equal to another digest
+            return ('unreadable', id(candidate))
+        return file_hash.digest()
+
+    def _get_lock(self, size):
+        return self.lock_list[size % len(self.lock_list)]
+
+    def _partial(self, candidate):
+        if candidate.partial is None:
+            with self.counter_lock:
+                self.partial_number += 1
+            candidate.partial = self._read_hash(candidate, True)
+            # small files are read whole by the partial stage
+            if candidate.size <= 2 * self.block_size:
+                candidate.full = candidate.partial
+        return candidate.partial
+
+    def _full(self, candidate):
+        if candidate.full is None:
+            with self.counter_lock:
+                self.full_number += 1
+            candidate.full = self._read_hash(candidate, False)
+        return candidate.full
+
+    def check(self, path, size, eager=False):
+        '''
+        return (duplicate, candidate). If path is not a duplicate, it is registered for the next checks.
+        candidate.full holds the digest of the whole content if it was computed
+        eager: hash path right away, to be used if path is going to be deleted
+        '''
+        with self.counter_lock:
+            self.file_number += 1
+        candidate = Candidate(path, size)
+        if eager:
+            # the new file only, no lock needed
+            self._partial(candidate)
+            self._full(candidate)
+        with self._get_lock(size):
+            return self._check(candidate, size)
+
+    def _check(self, candidate, size):
+        size_group = self.by_size.get(size)
+        if size_group is None:
+            self.by_size[size] = candidate
+            return False, candidate
+        if isinstance(size_group, Candidate):
+            size_group = self.by_size[size] = {self._partial(size_group): size_group}
+
+        partial_group = size_group.get(self._partial(candidate))
+        if partial_group is None:
+            size_group[candidate.partial] = candidate
+            return False, candidate
+        if isinstance(partial_group, Candidate):
+            partial_group = size_group[candidate.partial] = {self._full(partial_group): partial_group}
+
+        if self._full(candidate) in partial_group:
+            return True, candidate
+        partial_group[candidate.full] = candidate
+        return False, candidate
+
+    def discard(self, candidate):
+        '''
+        forget a candidate registered by check(), when the file could not be imported
+        '''
+        with self._get_lock(candidate.size):
+            self._discard(candidate)
+
+    def _discard(self, candidate):
+        size_group = self.by_size.get(candidate.size)
+        if size_group is candidate:
+            del self.by_size[candidate.size]
+        elif isinstance(size_group, dict):
+            partial_group = size_group.get(candidate.partial)
+            if partial_group is candidate:
+                del size_group[candidate.partial]
+            elif isinstance(partial_group, dict) and partial_group.get(candidate.full) is candidate:
+                del partial_group[candidate.full]
@@ -0,0 +1,79 @@
+import threading
+import time
+
+__version__='1.0'
+
+class DigestIndex:
+    '''
+    Persistent set of binary digests stored in a SQLite database (WAL mode)
+    New digests are buffered in memory and inserted in bulk every batch_size additions and on close()
+    Each digest records the top level input file (source) it was imported from, so the digests of an input file
+    processed again can be removed with discard_source()
+    '''
+    def __init__(self, path, batch_size=10000):
+        self.path = path
+        self.batch_size = batch_size
+        self.pending = {}
+        self.lock = threading.Lock()
+        # sqlite3 is only loaded when a database is used
+        import sqlite3
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS digest (digest BLOB PRIMARY KEY, size INTEGER, path TEXT, imported_at INTEGER, source TEXT) WITHOUT ROWID')
+        # databases created before the source column
+        if 'source' not in [X[1] for X in self.connection.execute('PRAGMA table_info(digest)')]:
+            self.connection.execute('ALTER TABLE digest ADD COLUMN source TEXT')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS digest_source ON digest (source)')
+        self.connection.commit()
+
+    def __contains__(self, digest):
+        digest = bytes(digest)
+        with self.lock:
+            if digest in self.pending:
+                return True
+            return self.connection.execute('SELECT 1 FROM digest WHERE digest = ?', (digest,)).fetchone() is not None
+
+    def add(self, digest, size=None, path=None, source=None):
+        with self.lock:
+            self.pending[bytes(digest)] = (size, path, int(time.time()), source)
+            if len(self.pending) >= self.batch_size:
+                self._flush()
+
+    def _flush(self):
+        if not self.pending:
+            return
+        with self.connection:
+            self.connection.executemany('INSERT OR IGNORE INTO digest (digest, size, path, imported_at, source) VALUES (?, ?, ?, ?, ?)', [(digest, *values) for digest, values in self.pending.items()])
+        self.pending = {}
+
+    def discard_source(self, source):
+        '''
+        remove the digests imported from the top level input file source, return their number
+        '''
+        with self.lock:
+            self._flush()
+            with self.connection:
+                return self.connection.execute('DELETE FROM digest WHERE source = ?', (source,)).rowcount
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def __len__(self):
+        with self.lock:
+            return self.connection.execute('SELECT COUNT(*) FROM digest').fetchone()[0] + len(self.pending)
+
+    def compact(self):
+        '''
+        Merge the WAL file into the database and rebuild it to reclaim free pages
+        '''
+        with self.lock:
+            self._flush()
+            self.connection.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            self.connection.execute('VACUUM')
+
+    def close(self):
+        with self.lock:
+            self._flush()
+            self.connection.close()
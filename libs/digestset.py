@@ -0,0 +1,183 @@
+import math
+
+__version__='1.0'
+
+class BloomFilter:
+    '''
+    Bloom filter for binary digests (16 bytes or more). Digests are already uniformly distributed,
+    so the bit positions are derived from the digest bytes instead of being hashed again
+    '''
+    def __init__(self, capacity, error_rate=0.01):
+        capacity = max(1, capacity)
+        self.bit_number = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_number = max(1, round(self.bit_number / capacity * math.log(2)))
+        self.bits = bytearray((self.bit_number + 7) // 8)
+
+    def _positions(self, digest):
+        # double hashing: position_i = h1 + i * h2
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:16], 'little') | 1
+        bit_number = self.bit_number
+        return [(h1 + i * h2) % bit_number for i in range(self.hash_number)]
+
+    def add(self, digest):
+        bits = self.bits
+        for position in self._positions(digest):
+            bits[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, digest):
+        bits = self.bits
+        for position in self._positions(digest):
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def memory_usage(self):
+        return len(self.bits)
+
+class DigestSet:
+    '''
+    Set of fixed size binary digests stored in a single bytearray (open addressing with linear probing)
+    A Bloom filter in front of the table answers most "never seen" lookups without probing it
+    The table is doubled when max_load is reached. The digests are moved to the new table a few slots at a time on the
+    next add() calls instead of all at once, so no add() stalls on a full rehash
+    Memory is 16 bytes per slot and about 1 byte per slot for the Bloom filter, i.e. 26 to 51 bytes per md5 digest
+    depending on the load, up to 1.5 times more while the digests of the old table are being moved
+    The set is not thread safe
+    '''
+    max_load = 0.66
+    # old slots moved on each add() while the table is doubled: all of them are moved before the new table is full
+    move_step = 8
+
+    def __init__(self, digest_size=16, capacity=1024, error_rate=0.01):
+        self.digest_size = digest_size
+        self.error_rate = error_rate
+        self.empty = bytes(digest_size)
+        # a digest made of null bytes can't be told apart from an empty slot
+        self.has_empty = False
+        self.count = 0
+        # (table, mask, bloom) being moved to the current table after a doubling, and the number of slots moved
+        self.old = None
+        self.moved = 0
+        slot_number = 1
+        while slot_number * self.max_load < capacity:
+            slot_number *= 2
+        self._allocate(slot_number)
+
+    def _allocate(self, slot_number):
+        self.slot_number = slot_number
+        self.mask = slot_number - 1
+        self.table = bytearray(slot_number * self.digest_size)
+        self.bloom = BloomFilter(int(slot_number * self.max_load), error_rate=self.error_rate)
+
+    def _check(self, digest):
+        if len(digest) != self.digest_size:
+            raise ValueError(f'Invalid digest size {len(digest)}, expected {self.digest_size}')
+        return bytes(digest)
+
+    def _find(self, digest, table, mask):
+        '''
+        return the table offset where digest is stored, or the one of the empty slot where it would be, and whether it was found
+        '''
+        size = self.digest_size
+        index = int.from_bytes(digest[:8], 'little') & mask
+        while True:
+            offset = index * size
+            current = table[offset:offset + size]
+            if current == digest:
+                return offset, True
+            if current == self.empty:
+                return offset, False
+            index = (index + 1) & mask
+
+    def _contains(self, digest):
+        if digest in self.bloom and self._find(digest, self.table, self.mask)[1]:
+            return True
+        if self.old is not None:
+            table, mask, bloom = self.old
+            # the slots already moved are still in the old table, so probing it stays valid
+            return digest in bloom and self._find(digest, table, mask)[1]
+        return False
+
+    def _insert(self, digest):
+        offset, found = self._find(digest, self.table, self.mask)
+        if not found:
+            self.table[offset:offset + self.digest_size] = digest
+            self.bloom.add(digest)
+
+    def _move(self, slot_number):
+        '''
+        move the next slot_number slots of the old table to the current one
+        '''
+        table = self.old[0]
+        size = self.digest_size
+        start = self.moved * size
+        end = min(len(table), start + slot_number * size)
+        for offset in range(start, end, size):
+            digest = bytes(table[offset:offset + size])
+            if digest != self.empty:
+                self._insert(digest)
+        self.moved = end // size
+        if end == len(table):
+            self.old = None
+
+    def _grow(self):
+        if self.old is not None:
+            self._move(len(self.old[0]))
+        self.old = (self.table, self.mask, self.bloom)
+        self.moved = 0
+        self._allocate(self.slot_number * 2)
+
+    def add(self, digest):
+        '''
+        add digest to the set, return False if it was already there
+        '''
+        digest = self._check(digest)
+        if digest == self.empty:
+            added = not self.has_empty
+            self.has_empty = True
+        else:
+            added = not self._contains(digest)
+            if added:
+                if (self.count + 1) > self.slot_number * self.max_load:
+                    self._grow()
+                self._insert(digest)
+                if self.old is not None:
+                    self._move(self.move_step)
+        if added:
+            self.count += 1
+        return added
+
+    def __contains__(self, digest):
+        digest = self._check(digest)
+        if digest == self.empty:
+            return self.has_empty
+        return self._contains(digest)
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        size = self.digest_size
+        if self.has_empty:
+            yield self.empty
+        for offset in range(0, len(self.table), size):
+            digest = bytes(self.table[offset:offset + size])
+            if digest != self.empty:
+                yield digest
+        if self.old is not None:
+            # the slots not moved yet
+            table = self.old[0]
+            for offset in range(self.moved * size, len(table), size):
+                digest = bytes(table[offset:offset + size])
+                if digest != self.empty:
+                    yield digest
+
+    def memory_usage(self):
+        '''
+        memory used by the tables and the Bloom filters, in bytes
+        '''
+        usage = len(self.table) + self.bloom.memory_usage()
+        if self.old is not None:
+            usage += len(self.old[0]) + self.old[2].memory_usage()
+        return usage
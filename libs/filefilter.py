@@ -0,0 +1,80 @@
+import fnmatch
+import re
+
+__version__='1.0'
+
+SIZE_UNIT_DICT = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3, 'T': 1024 ** 4}
+
+def parse_size(value):
+    '''
+    '10M' -> 10485760, units are powers of 1024 (K, M, G, T), a trailing B or iB is accepted
+    '''
+    match = re.fullmatch(r'\s*(\d+(?:\.\d+)?)\s*([KMGT]?)(?:I?B)?\s*', value.upper())
+    if match is None:
+        raise ValueError(f'Invalid size: {value}')
+    return int(float(match.group(1)) * SIZE_UNIT_DICT[match.group(2)])
+
+def compile_glob_list(glob_list):
+    '''
+    return a case insensitive regular expression matching one of the shell globs of glob_list, None if it is empty
+    '''
+    if not glob_list:
+        return None
+    return re.compile('|'.join(fnmatch.translate(X) for X in glob_list), re.IGNORECASE)
+
+class FileFilter:
+    '''
+    Select files by name, mimetype and size
+    A file is selected if it matches one of the include globs (if any), one of the included mimetypes (if any),
+    the size limits, and no exclude glob nor excluded mimetype
+    Name globs without a / are matched against the file name, the others against the whole path, * matching /
+    too (*/cache/*). Mimetypes are globs as well (image/*). Matching is case insensitive
+    '''
+    def __init__(self, include_list=[], exclude_list=[], mimetype_include_list=[], mimetype_exclude_list=[], min_size=None, max_size=None):
+        self.include_name = compile_glob_list([X for X in include_list if '/' not in X])
+        self.include_path = compile_glob_list([X for X in include_list if '/' in X])
+        self.exclude_name = compile_glob_list([X for X in exclude_list if '/' not in X])
+        self.exclude_path = compile_glob_list([X for X in exclude_list if '/' in X])
+        self.mimetype_include = compile_glob_list(mimetype_include_list)
+        self.mimetype_exclude = compile_glob_list(mimetype_exclude_list)
+        self.min_size = min_size
+        self.max_size = max_size
+
+    def is_excluded(self, path, mimetype=None):
+        '''
+        return True if path matches an exclude glob or mimetype an excluded mimetype
+        '''
+        path = path.replace('\\', '/')
+        name = path.rsplit('/', 1)[-1]
+        if self.exclude_name and self.exclude_name.match(name):
+            return True
+        if self.exclude_path and self.exclude_path.match(path):
+            return True
+        return mimetype is not None and self.mimetype_exclude is not None and self.mimetype_exclude.match(mimetype) is not None
+
+    def match_name(self, path):
+        if self.is_excluded(path):
+            return False
+        if not self.include_name and not self.include_path:
+            return True
+        path = path.replace('\\', '/')
+        return bool((self.include_name and self.include_name.match(path.rsplit('/', 1)[-1])) or (self.include_path and self.include_path.match(path)))
+
+    def match_size(self, size):
+        return (self.min_size is None or size >= self.min_size) and (self.max_size is None or size <= self.max_size)
+
+    def match_mimetype(self, mimetype):
+        if self.mimetype_exclude and self.mimetype_exclude.match(mimetype):
+            return False
+        return not self.mimetype_include or self.mimetype_include.match(mimetype) is not None
+
+    def match(self, path, size=None, mimetype=None):
+        '''
+        return True if the file is selected, the rules on size and mimetype are only checked if they are given
+        (the mimetype of an archive member is not known before it is extracted)
+        '''
+        if not self.match_name(path):
+            return False
+        if size is not None and not self.match_size(size):
+            return False
+        return mimetype is None or self.match_mimetype(mimetype)
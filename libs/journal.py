@@ -0,0 +1,180 @@
+import json
+import os
+import threading
+
+__version__='1.0'
+
+class JournalTask:
+    '''
+    Processing of a top level input file and of every file extracted from it
+    The task is done once every file of its tree is processed: acquire() is called when a file of the tree is
+    scheduled and release() when its processing is over
+    '''
+    def __init__(self, journal, path):
+        self.journal = journal
+        self.path = path
+        self.pending = 1
+        self.failed = False
+        self.lock = threading.Lock()
+
+    def acquire(self, number=1):
+        with self.lock:
+            self.pending += number
+
+    def release(self, failed=False):
+        with self.lock:
+            self.pending -= 1
+            self.failed = self.failed or failed
+            done = self.pending == 0 and not self.failed
+        if done:
+            self.journal.write({'event': 'done', 'path': self.path})
+
+    def add_output(self, output_path):
+        self.journal.write({'event': 'output', 'path': self.path, 'output': output_path})
+
+    def add_row(self, row, **kwargs):
+        self.journal.write({'event': 'row', 'path': self.path, 'row': row, **kwargs})
+
+class Journal:
+    '''
+    Append-only journal of a run in JSON lines, to resume it if it is interrupted
+    Each top level input file has a begin event when its processing starts, output events for the paths allocated
+    for it, row events for its summary rows and a done event when its whole tree is processed
+    Lines are flushed as they are written, an incomplete last line left by a crash is ignored
+    The begin event holds the size, modification time and inode of the file, to tell if it changed since
+    '''
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        # top level path -> {'done': bool, 'key': [size, mtime, inode], 'output': [output path], 'row': [row event]}
+        self.task_dict = {}
+        # run events, in order
+        self.run_list = []
+        complete = True
+        if os.path.exists(path):
+            complete = self._load()
+        self.fd = open(path, 'a')
+        if not complete:
+            self.fd.write('\n')
+            self.fd.flush()
+
+    def _load(self):
+        '''
+        read the events of a previous run, return False if the last line is incomplete
+        '''
+        complete = True
+        with open(self.path, 'r') as fd:
+            for line in fd:
+                complete = line.endswith('\n')
+                try:
+                    event = json.loads(line)
+                except ValueError:
+                    continue
+                if event['event'] == 'run':
+                    self.run_list.append(event)
+                    continue
+                task = self.task_dict.get(event['path'])
+                if event['event'] == 'begin' or task is None:
+                    # processing started over
+                    task = self.task_dict[event['path']] = {'done': False, 'key': event.get('key'), 'output': [], 'row': []}
+                if event['event'] == 'output':
+                    task['output'].append(event['output'])
+                elif event['event'] == 'row':
+                    task['row'].append(event)
+                elif event['event'] == 'done':
+                    task['done'] = True
+        return complete
+
+    def __len__(self):
+        return len(self.task_dict) + len(self.run_list)
+
+    def write(self, event):
+        line = json.dumps(event) + '\n'
+        with self.lock:
+            self.fd.write(line)
+            self.fd.flush()
+
+    def add_run(self, **kwargs):
+        self.write({'event': 'run', **kwargs})
+
+    def is_done(self, path):
+        task = self.task_dict.get(path)
+        return task is not None and task['done']
+
+    def is_modified(self, path, stat):
+        '''
+        return True if the file described by stat (os.stat_result) is not the one processed by a previous run
+        '''
+        task = self.task_dict.get(path)
+        return task is None or task['key'] != get_key(stat)
+
+    def forget(self, path):
+        '''
+        consider a file processed by a previous run as interrupted, so it is processed again
+        '''
+        self.task_dict[path]['done'] = False
+
+    def begin(self, path, stat=None):
+        '''
+        record the start of the processing of a top level input file, return its JournalTask
+        '''
+        self.write({'event': 'begin', 'path': path, 'key': get_key(stat) if stat else None})
+        return JournalTask(self, path)
+
+    def get_done_task_list(self):
+        '''
+        return the (path, row event list) of the top level input files processed by previous runs
+        '''
+        return [(X, Y['row']) for X, Y in self.task_dict.items() if Y['done']]
+
+    def get_interrupted_task_list(self):
+        '''
+        return the (path, output path list) of the top level input files whose processing was interrupted
+        '''
+        return [(X, Y['output']) for X, Y in self.task_dict.items() if not Y['done']]
+
+    def compact(self):
+        '''
+        rewrite the journal with only the last processing of each file and the last run of each target,
+        so a journal reused run after run (incremental mode) does not grow forever
+        '''
+        with self.lock:
+            self.fd.close()
+            # first pass: line number of the last begin of each file and of the last run of each target
+            last_begin = {}
+            last_run = {}
+            with open(self.path, 'r') as fd:
+                for index, line in enumerate(fd):
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        continue
+                    if event['event'] == 'begin':
+                        last_begin[event['path']] = index
+                    elif event['event'] == 'run':
+                        last_run[event.get('target')] = index
+            temporary_path = f'{self.path}.{os.getpid()}.tmp'
+            with open(self.path, 'r') as fd, open(temporary_path, 'w') as output_fd:
+                for index, line in enumerate(fd):
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        continue
+                    if event['event'] == 'run':
+                        keep = last_run.get(event.get('target')) == index
+                    else:
+                        keep = index >= last_begin.get(event['path'], 0)
+                    if keep:
+                        output_fd.write(line if line.endswith('\n') else line + '\n')
+            os.replace(temporary_path, self.path)
+            self.fd = open(self.path, 'a')
+
+    def close(self):
+        with self.lock:
+            self.fd.close()
+
+def get_key(stat):
+    '''
+    return what identifies a version of a file: size, modification time and inode
+    '''
+    return [stat.st_size, stat.st_mtime_ns, stat.st_ino]
@@ -17,9 +17,8 @@ Usage:
 """
 
 import sys
-import glob
+import os
 import ctypes
-import ctypes.util
 import threading
 
 from ctypes import c_char_p, c_int, c_size_t, c_void_p, byref, POINTER
@@ -48,6 +47,7 @@ class Magic:
         uncompress - Try to look inside compressed files.
         raw - Do not try to decode "non-printable" chars.
         """
+        _load_libmagic()
         self.flags = MAGIC_NONE
         if mime:
             self.flags |= MAGIC_MIME
@@ -91,8 +91,7 @@ class Magic:
 
     def from_file(self, filename):
         # raise FileNotFoundException or IOError if the file does not exist
-        with open(filename):
-            pass
+        os.stat(filename)
         with self.lock:
             try:
                 return maybe_decode(magic_file(self.cookie, filename))
@@ -129,13 +128,21 @@ class Magic:
             magic_close(self.cookie)
             self.cookie = None
 
-_instances = {}
+# number of bytes libmagic looks at. It is set explicitly, so that identifying the first
+# BYTES_MAX bytes of a file with from_buffer gives the same result as from_file
+BYTES_MAX = 1024 * 1024
+
+# one Magic instance per mode and per thread: a libmagic cookie can't be shared between
+# threads without a lock, and ctypes releases the GIL during the libmagic calls
+_instances = threading.local()
 
 
 def _get_magic_type(mime):
-    i = _instances.get(mime)
+    i = getattr(_instances, 'mime' if mime else 'text', None)
     if i is None:
-        i = _instances[mime] = Magic(mime=mime)
+        i = Magic(mime=mime)
+        i.setparam(MAGIC_PARAM_BYTES_MAX, BYTES_MAX)
+        setattr(_instances, 'mime' if mime else 'text', i)
     return i
 
 
@@ -165,40 +172,6 @@ def from_buffer(buffer, mime=False):
     return m.from_buffer(buffer)
 
 
-libmagic = None
-# Let's try to find magic or magic1
-dll = ctypes.util.find_library('magic') \
-    or ctypes.util.find_library('magic1') \
-    or ctypes.util.find_library('cygmagic-1') \
-    or ctypes.util.find_library('libmagic-1') \
-    or ctypes.util.find_library('msys-magic-1') #for MSYS2
-
-# necessary because find_library returns None if it doesn't find the library
-if dll:
-    libmagic = ctypes.CDLL(dll)
-
-if not libmagic or not libmagic._name:
-    windows_dlls = ['magic1.dll', 'cygmagic-1.dll', 'libmagic-1.dll', 'msys-magic-1.dll']
-    platform_to_lib = {'darwin': ['/opt/local/lib/libmagic.dylib',
-                                  '/usr/local/lib/libmagic.dylib'] +
-                       # Assumes there will only be one version installed
-                       glob.glob('/usr/local/Cellar/libmagic/*/lib/libmagic.dylib'),  # flake8:noqa
-                       'win32': windows_dlls,
-                       'cygwin': windows_dlls,
-                       'linux': ['libmagic.so.1'],  # fallback for some Linuxes (e.g. Alpine) where library search does not work # flake8:noqa
-                      }
-    platform = 'linux' if sys.platform.startswith('linux') else sys.platform
-    for dll in platform_to_lib.get(platform, []):
-        try:
-            libmagic = ctypes.CDLL(dll)
-            break
-        except OSError:
-            pass
-
-if not libmagic or not libmagic._name:
-    # It is better to raise an ImportError since we are importing magic module
-    raise ImportError('failed to find libmagic.  Check your installation')
-
 magic_t = ctypes.c_void_p
 
 
@@ -245,90 +218,165 @@ def coerce_filename(filename):
         return filename
 
 
-magic_open = libmagic.magic_open
-magic_open.restype = magic_t
-magic_open.argtypes = [c_int]
-
-magic_close = libmagic.magic_close
-magic_close.restype = None
-magic_close.argtypes = [magic_t]
-
-magic_error = libmagic.magic_error
-magic_error.restype = c_char_p
-magic_error.argtypes = [magic_t]
-
-magic_errno = libmagic.magic_errno
-magic_errno.restype = c_int
-magic_errno.argtypes = [magic_t]
-
-_magic_file = libmagic.magic_file
-_magic_file.restype = c_char_p
-_magic_file.argtypes = [magic_t, c_char_p]
-_magic_file.errcheck = errorcheck_null
-
-
 def magic_file(cookie, filename):
     return _magic_file(cookie, coerce_filename(filename))
 
-_magic_buffer = libmagic.magic_buffer
-_magic_buffer.restype = c_char_p
-_magic_buffer.argtypes = [magic_t, c_void_p, c_size_t]
-_magic_buffer.errcheck = errorcheck_null
-
 
 def magic_buffer(cookie, buf):
     return _magic_buffer(cookie, buf, len(buf))
 
 
-_magic_load = libmagic.magic_load
-_magic_load.restype = c_int
-_magic_load.argtypes = [magic_t, c_char_p]
-_magic_load.errcheck = errorcheck_negative_one
-
-
 def magic_load(cookie, filename):
     return _magic_load(cookie, coerce_filename(filename))
 
-magic_setflags = libmagic.magic_setflags
-magic_setflags.restype = c_int
-magic_setflags.argtypes = [magic_t, c_int]
-
-magic_check = libmagic.magic_check
-magic_check.restype = c_int
-magic_check.argtypes = [magic_t, c_char_p]
-
-magic_compile = libmagic.magic_compile
-magic_compile.restype = c_int
-magic_compile.argtypes = [magic_t, c_char_p]
-
-_magic_setparam = libmagic.magic_setparam
-_magic_setparam.restype = c_int
-_magic_setparam.argtypes = [magic_t, c_int, POINTER(c_size_t)]
-_magic_setparam.errcheck = errorcheck_negative_one
-
 
 def magic_setparam(cookie, param, val):
     v = c_size_t(val)
     return _magic_setparam(cookie, param, byref(v))
 
-_magic_getparam = libmagic.magic_getparam
-_magic_getparam.restype = c_int
-_magic_getparam.argtypes = [magic_t, c_int, POINTER(c_size_t)]
-_magic_getparam.errcheck = errorcheck_negative_one
-
 
 def magic_getparam(cookie, param):
     val = c_size_t()
     _magic_getparam(cookie, param, byref(val))
     return val.value
 
-magic_version = libmagic.magic_version
-magic_version.restype = c_int
-magic_version.argtypes = []
 
 def version():
+    _load_libmagic()
     return magic_version()
 
+
+_libmagic_lock = threading.Lock()
+
+# names bound by _load_libmagic, looked up by __getattr__ until then
+_LIBMAGIC_NAME_LIST = ['libmagic', 'magic_open', 'magic_close', 'magic_error', 'magic_errno',
+                       '_magic_file', '_magic_buffer', '_magic_load', 'magic_setflags',
+                       'magic_check', 'magic_compile', '_magic_setparam', '_magic_getparam',
+                       'magic_version']
+
+
+def _find_libmagic():
+    # find_library may run external commands (ldconfig, gcc), which is why
+    # the library is only looked up on first use
+    import ctypes.util
+    import glob
+
+    lib = None
+    # Let's try to find magic or magic1
+    dll = ctypes.util.find_library('magic') \
+        or ctypes.util.find_library('magic1') \
+        or ctypes.util.find_library('cygmagic-1') \
+        or ctypes.util.find_library('libmagic-1') \
+        or ctypes.util.find_library('msys-magic-1') #for MSYS2
+
+    # necessary because find_library returns None if it doesn't find the library
+    if dll:
+        lib = ctypes.CDLL(dll)
+
+    if not lib or not lib._name:
+        windows_dlls = ['magic1.dll', 'cygmagic-1.dll', 'libmagic-1.dll', 'msys-magic-1.dll']
+        platform_to_lib = {'darwin': ['/opt/local/lib/libmagic.dylib',
+                                      '/usr/local/lib/libmagic.dylib'] +
+                           # Assumes there will only be one version installed
+                           glob.glob('/usr/local/Cellar/libmagic/*/lib/libmagic.dylib'),  # flake8:noqa
+                           'win32': windows_dlls,
+                           'cygwin': windows_dlls,
+                           'linux': ['libmagic.so.1'],  # fallback for some Linuxes (e.g. Alpine) where library search does not work # flake8:noqa
+                          }
+        platform = 'linux' if sys.platform.startswith('linux') else sys.platform
+        for dll in platform_to_lib.get(platform, []):
+            try:
+                lib = ctypes.CDLL(dll)
+                break
+            except OSError:
+                pass
+
+    if not lib or not lib._name:
+        raise ImportError('failed to find libmagic.  Check your installation')
+    return lib
+
+
+def _load_libmagic():
+    """
+    Load libmagic and declare its functions, once
+    """
+    global libmagic, magic_open, magic_close, magic_error, magic_errno, _magic_file, \
+        _magic_buffer, _magic_load, magic_setflags, magic_check, magic_compile, \
+        _magic_setparam, _magic_getparam, magic_version
+    if 'libmagic' in globals():
+        return
+    with _libmagic_lock:
+        if 'libmagic' in globals():
+            return
+        lib = _find_libmagic()
+
+        magic_open = lib.magic_open
+        magic_open.restype = magic_t
+        magic_open.argtypes = [c_int]
+
+        magic_close = lib.magic_close
+        magic_close.restype = None
+        magic_close.argtypes = [magic_t]
+
+        magic_error = lib.magic_error
+        magic_error.restype = c_char_p
+        magic_error.argtypes = [magic_t]
+
+        magic_errno = lib.magic_errno
+        magic_errno.restype = c_int
+        magic_errno.argtypes = [magic_t]
+
+        _magic_file = lib.magic_file
+        _magic_file.restype = c_char_p
+        _magic_file.argtypes = [magic_t, c_char_p]
+        _magic_file.errcheck = errorcheck_null
+
+        _magic_buffer = lib.magic_buffer
+        _magic_buffer.restype = c_char_p
+        _magic_buffer.argtypes = [magic_t, c_void_p, c_size_t]
+        _magic_buffer.errcheck = errorcheck_null
+
+        _magic_load = lib.magic_load
+        _magic_load.restype = c_int
+        _magic_load.argtypes = [magic_t, c_char_p]
+        _magic_load.errcheck = errorcheck_negative_one
+
+        magic_setflags = lib.magic_setflags
+        magic_setflags.restype = c_int
+        magic_setflags.argtypes = [magic_t, c_int]
+
+        magic_check = lib.magic_check
+        magic_check.restype = c_int
+        magic_check.argtypes = [magic_t, c_char_p]
+
+        magic_compile = lib.magic_compile
+        magic_compile.restype = c_int
+        magic_compile.argtypes = [magic_t, c_char_p]
+
+        _magic_setparam = lib.magic_setparam
+        _magic_setparam.restype = c_int
+        _magic_setparam.argtypes = [magic_t, c_int, POINTER(c_size_t)]
+        _magic_setparam.errcheck = errorcheck_negative_one
+
+        _magic_getparam = lib.magic_getparam
+        _magic_getparam.restype = c_int
+        _magic_getparam.argtypes = [magic_t, c_int, POINTER(c_size_t)]
+        _magic_getparam.errcheck = errorcheck_negative_one
+
+        magic_version = lib.magic_version
+        magic_version.restype = c_int
+        magic_version.argtypes = []
+
+        libmagic = lib
+
+
+def __getattr__(name):
+    # libmagic and its functions are module attributes once loaded
+    if name in _LIBMAGIC_NAME_LIST:
+        _load_libmagic()
+        return globals()[name]
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+
 MAGIC_NONE = 0x000000 # No flags
 MAGIC_DEBUG = 0x000001 # Turn on debugging
 MAGIC_SYMLINK = 0x000002 # Follow symlinks
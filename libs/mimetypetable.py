@@ -0,0 +1,89 @@
+import functools
+import marshal
+import os
+
+__version__='1.0'
+
+# changed when the cached form of the table changes
+CACHE_VERSION = 1
+
+class MimetypeTable:
+    '''
+    Table of the known mimetypes and of their file extensions, compound ones included (.tar.gz)
+    Extensions are matched case insensitively, the longest known extension of a file name wins
+    '''
+    def __init__(self, mimetype_dict):
+        # mimetype -> list of extensions, as given
+        self.mimetype_dict = {}
+        # lower case extension -> list of mimetypes
+        self.extension_dict = {}
+        for mimetype, extension_list in mimetype_dict.items():
+            extension_list = [X if X.startswith('.') else f'.{X}' for X in extension_list]
+            self.mimetype_dict[mimetype] = extension_list
+            for extension in extension_list:
+                self.extension_dict.setdefault(extension.lower(), []).append(mimetype)
+
+    @classmethod
+    def from_file(cls, path, cache_path=None):
+        '''
+        load the table from a json file {mimetype: [extension, ...]}
+        if cache_path is set, the built table is stored there with marshal and loaded from it as long as the json
+        file is not modified, the same way python caches bytecode. Failing to write the cache is not an error
+        '''
+        stat = os.stat(path)
+        key = (CACHE_VERSION, stat.st_mtime_ns, stat.st_size)
+        if cache_path:
+            try:
+                with open(cache_path, 'rb') as fd:
+                    cached_key, mimetype_dict, extension_dict = marshal.loads(fd.read())
+                if cached_key == key:
+                    table = cls({})
+                    table.mimetype_dict = mimetype_dict
+                    table.extension_dict = extension_dict
+                    return table
+            except (OSError, EOFError, ValueError, TypeError):
+                pass
+        # json is only imported when there is no valid cache
+        import json
+        with open(path, 'r') as fd:
+            table = cls(json.load(fd))
+        if cache_path:
+            try:
+                os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+                temporary_path = f'{cache_path}.{os.getpid()}.tmp'
+                with open(temporary_path, 'wb') as fd:
+                    marshal.dump((key, table.mimetype_dict, table.extension_dict), fd)
+                os.replace(temporary_path, cache_path)
+            except OSError:
+                pass
+        return table
+
+    def get_extension_list(self, mimetype):
+        return self.mimetype_dict.get(mimetype, [])
+
+    def get_mimetype_list(self, extension):
+        return self.extension_dict.get(extension.lower(), [])
+
+    def split_extension(self, basename):
+        '''
+        return (filename, extension) where extension is the longest known extension of basename, else its last
+        dotted part, else None
+        every extension starts with a dot, so only the suffixes starting at a dot of basename are looked up
+        '''
+        lower_basename = basename.lower()
+        index = lower_basename.find('.')
+        if index < 0:
+            return basename, None
+        while index >= 0:
+            if lower_basename[index:] in self.extension_dict:
+                return basename[:index], basename[index:]
+            index = lower_basename.find('.', index + 1)
+        index = basename.rindex('.')
+        return basename[:index], basename[index:]
+
+@functools.lru_cache(maxsize=None)
+def load_mimetype_table(path, cache_path=None):
+    '''
+    return the MimetypeTable of a json file {mimetype: [extension, ...]}, loaded once per path
+    '''
+    return MimetypeTable.from_file(path, cache_path=cache_path)
@@ -0,0 +1,67 @@
+import os
+import threading
+
+__version__='1.0'
+
+class NameReservation:
+    '''
+    Index of the names allocated in each directory, used to pick a free name without probing the file system
+    with name_1, name_2, ... on every call
+    The names of a directory are read once from disk the first time the directory is seen, and the next suffix
+    to try is remembered for each base name, so allocating the n-th copy of the same name is O(1)
+    Thread safe
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        # directory -> set of names taken in it
+        self.directories = {}
+        # (directory, base name, delimiter, extension) -> next suffix to try
+        self.next_suffix = {}
+
+    def _names(self, directory):
+        names = self.directories.get(directory)
+        if names is None:
+            try:
+                names = set(os.listdir(directory or '.'))
+            except OSError:
+                names = set()
+            self.directories[directory] = names
+        return names
+
+    def _taken(self, directory, names, name):
+        # a single stat catches the files created on disk by external tools after the directory was read
+        return name in names or os.path.lexists(os.path.join(directory, name))
+
+    def reserve(self, path, delimiter='_', extension=None):
+        '''
+        return path if it is free, else the first free path with an incremented base name,
+        i.e. base{delimiter}{n}{extension}. The returned path is taken until the end of the run
+        '''
+        directory, name = os.path.split(path)
+        with self.lock:
+            names = self._names(directory)
+            if not self._taken(directory, names, name):
+                names.add(name)
+                return path
+            base = name[:-len(extension)] if extension else name
+            key = (directory, base, delimiter, extension)
+            suffix = self.next_suffix.get(key, 1)
+            while self._taken(directory, names, f'{base}{delimiter}{suffix}{extension or ""}'):
+                suffix += 1
+            name = f'{base}{delimiter}{suffix}{extension or ""}'
+            self.next_suffix[key] = suffix + 1
+            names.add(name)
+            return os.path.join(directory, name)
+
+    def release(self, path):
+        '''
+        make path available again, once what was created there is removed
+        '''
+        directory, name = os.path.split(path)
+        with self.lock:
+            self.directories.get(directory, set()).discard(name)
+
+    def __contains__(self, path):
+        directory, name = os.path.split(path)
+        with self.lock:
+            return name in self.directories.get(directory, ())
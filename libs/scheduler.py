@@ -0,0 +1,256 @@
+import contextlib
+import logging
+import os
+import threading
+import time
+
+__version__='1.0'
+
+CGROUP_ROOT = '/sys/fs/cgroup'
+# memory limits above this are "no limit" (cgroup v1 reports a huge page aligned number)
+UNLIMITED_MEMORY = 1 << 60
+
+def _get_cgroup_path_dict():
+    '''
+    return {controller: cgroup path} of the current process, the cgroup v2 path is under the '' key
+    '''
+    path_dict = {}
+    try:
+        with open('/proc/self/cgroup', 'r') as fd:
+            for line in fd:
+                _, controller_list, path = line.rstrip('\n').split(':', 2)
+                for controller in controller_list.split(','):
+                    path_dict[controller] = path
+    except (OSError, ValueError):
+        pass
+    return path_dict
+
+def read_cgroup_file(controller, name):
+    '''
+    return the content of a cgroup file of the current process, or None
+    controller is the cgroup v1 controller (cpu, memory...) of the file, it is not used with cgroup v2
+    in a container, the cgroup of the process is usually mounted as the root of the hierarchy
+    '''
+    path_dict = _get_cgroup_path_dict()
+    if os.path.exists(os.path.join(CGROUP_ROOT, 'cgroup.controllers')):
+        directory_list = [os.path.join(CGROUP_ROOT, path_dict.get('', '/').lstrip('/')), CGROUP_ROOT]
+    else:
+        directory_list = [os.path.join(CGROUP_ROOT, controller, path_dict.get(controller, '/').lstrip('/')), os.path.join(CGROUP_ROOT, controller)]
+    for directory in directory_list:
+        try:
+            with open(os.path.join(directory, name), 'r') as fd:
+                return fd.read().strip()
+        except OSError:
+            continue
+    return None
+
+def get_cpu_limit():
+    '''
+    return the number of CPUs the process can use: its CPU affinity bounded by the cgroup CPU quota
+    '''
+    try:
+        cpu_number = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpu_number = os.cpu_count() or 1
+    quota = None
+    # cgroup v2: "$MAX $PERIOD" or "max $PERIOD"
+    value = read_cgroup_file('cpu', 'cpu.max')
+    if value:
+        max_value, _, period = value.partition(' ')
+        if max_value != 'max':
+            quota = int(max_value) / int(period or 100000)
+    else:
+        # cgroup v1, -1 if not limited
+        max_value = read_cgroup_file('cpu', 'cpu.cfs_quota_us')
+        period = read_cgroup_file('cpu', 'cpu.cfs_period_us')
+        if max_value and period and int(max_value) > 0:
+            quota = int(max_value) / int(period)
+    if quota:
+        cpu_number = min(cpu_number, max(1, int(quota + 0.5)))
+    return cpu_number
+
+def _read_meminfo():
+    meminfo = {}
+    try:
+        with open('/proc/meminfo', 'r') as fd:
+            for line in fd:
+                key, _, value = line.partition(':')
+                # in kB
+                meminfo[key] = int(value.split()[0]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return meminfo
+
+def get_memory_limit():
+    '''
+    return the memory the process can use in bytes: the cgroup memory limit if any, else the physical memory
+    None if unknown
+    '''
+    value = read_cgroup_file('memory', 'memory.max') or read_cgroup_file('memory', 'memory.limit_in_bytes')
+    if value and value != 'max' and int(value) < UNLIMITED_MEMORY:
+        return int(value)
+    return _read_meminfo().get('MemTotal')
+
+def get_memory_usage():
+    '''
+    return the memory used in bytes by the cgroup of the process, or by the whole system, None if unknown
+    the inactive page cache of the cgroup is not counted: extracting files fills it, and it is reclaimed first
+    '''
+    value = read_cgroup_file('memory', 'memory.current') or read_cgroup_file('memory', 'memory.usage_in_bytes')
+    if value:
+        usage = int(value)
+        for line in (read_cgroup_file('memory', 'memory.stat') or '').splitlines():
+            key, _, inactive = line.partition(' ')
+            # cgroup v2 and v1 names
+            if key in ['inactive_file', 'total_inactive_file']:
+                usage -= int(inactive)
+                break
+        return max(0, usage)
+    meminfo = _read_meminfo()
+    if 'MemTotal' in meminfo and 'MemAvailable' in meminfo:
+        return meminfo['MemTotal'] - meminfo['MemAvailable']
+    return None
+
+def get_cpu_times():
+    '''
+    return (total, idle, iowait) CPU times of the system in clock ticks, from /proc/stat, or None
+    '''
+    try:
+        with open('/proc/stat', 'r') as fd:
+            value_list = [int(X) for X in fd.readline().split()[1:]]
+    except (OSError, ValueError):
+        return None
+    # user nice system idle iowait irq softirq steal guest guest_nice, guest times are included in user and nice
+    return sum(value_list[:8]), value_list[3], value_list[4]
+
+def get_cgroup_cpu_usage():
+    '''
+    return the CPU time used by the cgroup of the process in seconds, or None
+    '''
+    value = read_cgroup_file('cpu', 'cpu.stat')
+    if value and 'usage_usec' in value:
+        for line in value.splitlines():
+            key, _, usage = line.partition(' ')
+            if key == 'usage_usec':
+                return int(usage) / 1000000
+    value = read_cgroup_file('cpuacct', 'cpuacct.usage')
+    if value:
+        # in nanoseconds
+        return int(value) / 1000000000
+    return None
+
+class AdaptiveScheduler:
+    '''
+    Limit the number of tasks (extractions) running at once and tune that limit from what is measured while they run:
+    - the throughput (bytes of the tasks completed per second)
+    - the iowait of the system: more tasks only thrash a slow or remote disk
+    - the CPU usage against the CPU limit (affinity and cgroup quota)
+    - the memory usage against the memory limit (cgroup limit, else physical memory)
+    Every interval seconds, the limit is halved if the memory usage is over memory_high, decreased if the disk is
+    saturated or if the last increase lowered the throughput, and increased if every slot was busy while some CPU
+    was left. The limit stays between min_limit and max_limit, it starts at the CPU limit
+    with scheduler.slot(size):
+        extract()
+    '''
+    def __init__(self, max_limit, min_limit=1, interval=2.0, memory_high=0.85, iowait_high=0.25, cpu_high=0.9):
+        self.cpu_limit = get_cpu_limit()
+        self.memory_limit = get_memory_limit()
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = min(self.max_limit, max(self.min_limit, self.cpu_limit))
+        self.interval = interval
+        self.memory_high = memory_high
+        self.iowait_high = iowait_high
+        self.cpu_high = cpu_high
+        self.condition = threading.Condition()
+        self.running = 0
+        self.waiting = 0
+        # set when a task waited for a slot during the current interval
+        self.saturated = False
+        self.completed_size = 0
+        self.last_throughput = None
+        self.last_change = 0
+        self.lowest_limit = self.highest_limit = self.limit
+        self._start_interval()
+
+    def _start_interval(self):
+        self.interval_start = time.monotonic()
+        self.cpu_times = get_cpu_times()
+        self.cpu_usage = get_cgroup_cpu_usage()
+        self.completed_size = 0
+        self.saturated = self.waiting > 0
+
+    def acquire(self):
+        with self.condition:
+            if self.running >= self.limit:
+                self.saturated = True
+                self.waiting += 1
+                while self.running >= self.limit:
+                    self.condition.wait()
+                self.waiting -= 1
+            self.running += 1
+
+    def release(self, size=0):
+        with self.condition:
+            self.running -= 1
+            self.completed_size += size
+            if time.monotonic() - self.interval_start >= self.interval:
+                self._tune()
+            self.condition.notify_all()
+
+    @contextlib.contextmanager
+    def slot(self, size=0):
+        '''
+        run a task of size bytes, the size is only used to measure the throughput
+        '''
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release(size)
+
+    def _measure(self, elapsed):
+        '''
+        return (iowait, cpu) of the interval, as fractions of the system CPU time and of the CPU limit, None if unknown
+        '''
+        iowait = cpu = None
+        cpu_times = get_cpu_times()
+        if cpu_times and self.cpu_times and cpu_times[0] > self.cpu_times[0]:
+            total = cpu_times[0] - self.cpu_times[0]
+            iowait = (cpu_times[2] - self.cpu_times[2]) / total
+            busy = total - (cpu_times[1] - self.cpu_times[1]) - (cpu_times[2] - self.cpu_times[2])
+            cpu = busy / total * (os.cpu_count() or 1) / self.cpu_limit
+        cpu_usage = get_cgroup_cpu_usage()
+        if cpu_usage is not None and self.cpu_usage is not None:
+            cpu = (cpu_usage - self.cpu_usage) / elapsed / self.cpu_limit
+        return iowait, cpu
+
+    def _tune(self):
+        elapsed = time.monotonic() - self.interval_start
+        throughput = self.completed_size / elapsed
+        iowait, cpu = self._measure(elapsed)
+        memory_usage = get_memory_usage()
+        memory = memory_usage / self.memory_limit if memory_usage is not None and self.memory_limit else None
+        limit = self.limit
+        reason = None
+        if memory is not None and memory > self.memory_high:
+            limit = limit // 2
+            reason = f'memory usage {memory:.0%}'
+        elif self.last_change > 0 and self.last_throughput and throughput < self.last_throughput * 0.95:
+            limit -= 1
+            reason = f'throughput down to {throughput / 1024 / 1024:.1f} MiB/s'
+        elif iowait is not None and iowait > self.iowait_high:
+            limit -= 1
+            reason = f'iowait {iowait:.0%}'
+        elif self.saturated and (cpu is None or cpu < self.cpu_high):
+            limit += 1
+            reason = 'every slot busy' if cpu is None else f'every slot busy, CPU usage {cpu:.0%}'
+        limit = min(self.max_limit, max(self.min_limit, limit))
+        if limit != self.limit:
+            logging.debug(f'Concurrent extraction limit {self.limit} -> {limit}: {reason}')
+        self.last_change = limit - self.limit
+        self.limit = limit
+        self.lowest_limit = min(self.lowest_limit, limit)
+        self.highest_limit = max(self.highest_limit, limit)
+        self.last_throughput = throughput
+        self._start_interval()
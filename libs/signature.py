@@ -0,0 +1,35 @@
+__version__='1.0'
+
+# bytes needed by sniff() to test every signature
+HEADER_SIZE = 512
+
+# (offset, magic bytes, mimetype), the mimetypes are the ones reported by libmagic for the same files
+# formats which libmagic refines further or validates beyond their magic bytes are left out: zip (docx, jar,
+# apk...), ar (deb), lzop, cab
+SIGNATURE_LIST = [
+    (0, b'\x1f\x8b', 'application/gzip'),
+    (0, b'\x28\xb5\x2f\xfd', 'application/zstd'),
+    (0, b'\xfd7zXZ\x00', 'application/x-xz'),
+    (0, b'7z\xbc\xaf\x27\x1c', 'application/x-7z-compressed'),
+    (0, b'Rar!\x1a\x07', 'application/x-rar'),
+    (0, b'LZIP', 'application/x-lzip'),
+    (0, b'\x1f\x9d', 'application/x-compress'),
+    (0, b'xar!', 'application/x-xar'),
+    (0, b'070701', 'application/x-cpio'),
+    (0, b'070702', 'application/x-cpio'),
+    (0, b'070707', 'application/x-cpio'),
+    (257, b'ustar\x00', 'application/x-tar'),
+    (257, b'ustar  \x00', 'application/x-tar'),
+]
+
+def sniff(header):
+    '''
+    return the mimetype of a file from its first HEADER_SIZE bytes, or None if the signature is unknown
+    '''
+    for offset, signature, mimetype in SIGNATURE_LIST:
+        if header.startswith(signature, offset):
+            return mimetype
+    # BZh followed by the block size, from 1 to 9
+    if header[:3] == b'BZh' and len(header) > 3 and 0x31 <= header[3] <= 0x39:
+        return 'application/x-bzip2'
+    return None
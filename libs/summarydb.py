@@ -0,0 +1,73 @@
+import re
+import threading
+
+__version__='1.0'
+
+class SummaryDatabase:
+    '''
+    Summary rows stored in a SQLite database (WAL mode) instead of a CSV file, one column per header field
+    plus parent_path, the input path of the archive a file was extracted from
+    Rows are buffered in memory and inserted in bulk every batch_size rows and on close()
+    '''
+    # columns looked up by the usual queries: where does this hash come from, what did this archive contain...
+    index_column_list = ['md5', 'mime_type', 'output_full_path', 'input_full_path', 'parent_path']
+
+    def __init__(self, path, batch_size=1000):
+        self.path = path
+        self.batch_size = batch_size
+        self.pending = []
+        self.column_list = None
+        self.lock = threading.Lock()
+        # sqlite3 is only loaded when a database is used
+        import sqlite3
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+
+    @staticmethod
+    def get_column_name(field):
+        '''
+        'Input Full Path' -> input_full_path
+        '''
+        return re.sub(r'\W+', '_', field.strip()).strip('_').lower()
+
+    def create_table(self, header):
+        '''
+        (re)create the file table for the given header on first call, later calls must give the same header
+        '''
+        column_list = [self.get_column_name(X) for X in header] + ['parent_path']
+        with self.lock:
+            if self.column_list is not None:
+                if column_list != self.column_list:
+                    raise ValueError('All the summaries of a database must have the same columns')
+                return
+            self.column_list = column_list
+            with self.connection:
+                # the database holds the summary of a single run, like the CSV file
+                self.connection.execute('DROP TABLE IF EXISTS file')
+                self.connection.execute(f'CREATE TABLE file (id INTEGER PRIMARY KEY, {", ".join(column_list)})')
+                for column in self.index_column_list:
+                    if column in column_list:
+                        self.connection.execute(f'CREATE INDEX file_{column} ON file ({column})')
+
+    def writerow(self, row, parent=None):
+        with self.lock:
+            self.pending.append((*row, parent))
+            if len(self.pending) >= self.batch_size:
+                self._flush()
+
+    def _flush(self):
+        if not self.pending:
+            return
+        with self.connection:
+            self.connection.executemany(f'INSERT INTO file ({", ".join(self.column_list)}) VALUES ({", ".join("?" * len(self.column_list))})', self.pending)
+        self.pending = []
+
+    def flush(self):
+        with self.lock:
+            self._flush()
+
+    def close(self):
+        with self.lock:
+            self._flush()
+            self.connection.close()
@@ -1,10 +1,16 @@
 from datetime import datetime
 from zoneinfo import ZoneInfo
 
+import collections
+import contextlib
+import contextvars
+import csv
+import errno
 import hashlib
 import logging
 import secrets
 import subprocess
+import threading
 import re
 import os
 
@@ -63,49 +69,476 @@ def parse_boolean_string(data, none=False):
 def get_random(length=20, choice='abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ1234567890-+=*!@#$%^&(){}[]|:;,.?/"\''):
     return ''.join((secrets.choice(choice) for i in range(length)))
 
+# bytes of the stdout and stderr of a command kept in memory, the end of the output is kept
+OUTPUT_TAIL_SIZE = 64 * 1024
+PIPE_READ_SIZE = 64 * 1024
+# file the whole output of the commands is appended to, set per task by the caller
+COMMAND_LOG_PATH = contextvars.ContextVar('COMMAND_LOG_PATH', default=None)
+
+class OutputTail:
+    '''
+    Keep the last size bytes written to it: the output of a command can be huge (tar xv of millions of members)
+    while only its end is useful to explain a failure
+    '''
+    def __init__(self, size=OUTPUT_TAIL_SIZE):
+        self.size = size
+        self.chunk_list = collections.deque()
+        self.length = 0
+        self.truncated = False
+
+    def write(self, data):
+        if not data:
+            return
+        self.chunk_list.append(bytes(data))
+        self.length += len(data)
+        while self.length - len(self.chunk_list[0]) >= self.size:
+            self.length -= len(self.chunk_list.popleft())
+            self.truncated = True
+
+    def getvalue(self):
+        '''
+        return the kept output decoded, starting at a line boundary and after a [...] line if the output was truncated
+        '''
+        data = b''.join(self.chunk_list)
+        truncated = self.truncated
+        if len(data) > self.size:
+            data = data[-self.size:]
+            truncated = True
+        if truncated:
+            data = b'[...]\n' + data[data.find(b'\n') + 1:]
+        return data.decode(errors='replace')
+
+class CommandLog:
+    '''
+    Append the output of a command to the file set in COMMAND_LOG_PATH, if any
+    Failing to write the log is not an error
+    '''
+    def __init__(self, command):
+        self.fd = None
+        self.lock = threading.Lock()
+        path = COMMAND_LOG_PATH.get()
+        if not path:
+            return
+        try:
+            make_directories(os.path.dirname(path))
+            self.fd = open(path, 'ab')
+            self.fd.write(('$ ' + ' '.join(command) + '\n').encode(errors='surrogateescape'))
+        except OSError as e:
+            logging.warning(f'Can not write command log {path}: {e}')
+            self.close()
+
+    def write(self, data):
+        if self.fd is None:
+            return
+        with self.lock:
+            try:
+                self.fd.write(data)
+            except OSError as e:
+                logging.warning(f'Can not write command log {self.fd.name}: {e}')
+                self.close()
+
+    def close(self):
+        if self.fd is not None:
+            self.fd.close()
+            self.fd = None
+
+def _drain_pipe(pipe, tail, command_log):
+    while data := pipe.read1(PIPE_READ_SIZE):
+        tail.write(data)
+        command_log.write(data)
+
+async def _drain_stream(stream, tail, command_log):
+    while data := await stream.read(PIPE_READ_SIZE):
+        tail.write(data)
+        command_log.write(data)
+
+class CommandRunner:
+    '''
+    Run commands with asyncio subprocesses in an event loop of its own thread, at most max_process at once
+    Their stdout and stderr are read asynchronously, so a waiting command costs no thread of its own
+    run() can be called from any thread and waits for the end of the command, slot() reserves a process slot
+    for a command started by other means
+    The event loop is only started (and asyncio imported) on first use, max_process must be set before
+    '''
+    def __init__(self, max_process=None):
+        self.max_process = max_process or os.cpu_count() or 1
+        self.loop = None
+        self.semaphore = None
+        self.lock = threading.Lock()
+
+    def _get_loop(self):
+        with self.lock:
+            if self.loop is None:
+                import asyncio
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name='CommandRunner', daemon=True).start()
+                self.loop = loop
+            return self.loop
+
+    async def _acquire(self):
+        import asyncio
+        # created in the event loop, which only runs in its own thread
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.max_process)
+        await self.semaphore.acquire()
+
+    async def _run(self, command, stdin, stdout, stderr, env, stdout_tail, stderr_tail, command_log):
+        import asyncio
+        await self._acquire()
+        try:
+            process = await asyncio.create_subprocess_exec(*command, stdin=stdin, stdout=stdout or subprocess.PIPE, stderr=stderr or subprocess.PIPE, env=env)
+            # both pipes are drained at the same time so the command never blocks on a full one
+            await asyncio.gather(*[_drain_stream(X, Y, command_log) for X, Y in [(process.stdout, stdout_tail), (process.stderr, stderr_tail)] if Y is not None])
+            return await process.wait()
+        finally:
+            self.semaphore.release()
+
+    def run(self, command, stdin=None, stdout=None, stderr=None, env=None, stdout_tail=None, stderr_tail=None, command_log=None):
+        '''
+        run command and return its exit code, its output is written to stdout_tail and stderr_tail (OutputTail)
+        unless a file descriptor is given for stdout or stderr
+        '''
+        import asyncio
+        future = asyncio.run_coroutine_threadsafe(self._run(command, stdin, stdout, stderr, env, stdout_tail, stderr_tail, command_log), self._get_loop())
+        return future.result()
+
+    @contextlib.contextmanager
+    def slot(self):
+        import asyncio
+        loop = self._get_loop()
+        asyncio.run_coroutine_threadsafe(self._acquire(), loop).result()
+        try:
+            yield
+        finally:
+            loop.call_soon_threadsafe(self.semaphore.release)
+
+# runner of every external command
+COMMAND_RUNNER = CommandRunner()
+
 def do_system_command(command, stdin=None, stdout=None, stderr=None, env={}):
     '''
     stdin can be a file descriptor
+    stdout and stderr are returned decoded unless a file descriptor is given for them (None is returned instead),
+    only their last OUTPUT_TAIL_SIZE bytes are kept, the whole output goes to the command log if one is set
+    the command is run by COMMAND_RUNNER, it may wait for a process slot
     '''
     for key, value in os.environ.items():
         env[key] = value
 
     logging.debug('Executing system command: ' + ' '.join([f'"{X}"' if ' ' in X else X for X in command]))
-    if not stdout:
-        stdout_fd = subprocess.PIPE
-    else:
-        stdout_fd = stdout
-    if not stderr:
-        stderr_fd = subprocess.PIPE
-    else:
-        stderr_fd = stderr
-    process = subprocess.Popen(command, stdout=stdout_fd, stderr=stderr_fd, stdin=stdin, env=env)
-    stdout_output, stderr_output = process.communicate()
-    return_code = process.returncode
-    if stdout:
-        stdout_output = None
-    else:
-        if stdout_output is None:
-            stdout_output = ''
-        else:
-            stdout_output = stdout_output.decode()
-        if stderr_output is None:
-            stderr_output = ''
-        else:
-            stderr_output = stderr_output.decode()
-        return stdout_output, stderr_output, return_code
-    if stderr:
-        stderr_output = None
-    else:
-        if stderr_output is None:
-            stderr_output = ''
+    command_log = CommandLog(command)
+    stdout_tail = None if stdout else OutputTail()
+    stderr_tail = None if stderr else OutputTail()
+    try:
+        return_code = COMMAND_RUNNER.run(command, stdin=stdin, stdout=stdout, stderr=stderr, env=env, stdout_tail=stdout_tail, stderr_tail=stderr_tail, command_log=command_log)
+    finally:
+        command_log.close()
+    stdout_output = None if stdout_tail is None else stdout_tail.getvalue()
+    stderr_output = None if stderr_tail is None else stderr_tail.getvalue()
+    return stdout_output, stderr_output, return_code
+
+class CommandStream:
+    '''
+    Run command with its stdout readable as a stream:
+    with CommandStream(command) as process:
+        process.stdout.read()
+    stderr (decoded) and returncode are set when leaving the block
+    the command takes one of the process slots of COMMAND_RUNNER while it runs
+    '''
+    def __init__(self, command):
+        self.command = command
+        self.process = None
+        self.stdout = None
+        self.stderr = None
+        self.returncode = None
+
+    def __enter__(self):
+        logging.debug('Executing system command: ' + ' '.join([f'"{X}"' if ' ' in X else X for X in self.command]))
+        # stderr goes to a temporary file so a chatty command can not block on a full pipe
+        import tempfile
+        self.stderr_fd = tempfile.TemporaryFile()
+        self.slot = COMMAND_RUNNER.slot()
+        self.slot.__enter__()
+        try:
+            self.process = subprocess.Popen(self.command, stdout=subprocess.PIPE, stderr=self.stderr_fd)
+        except BaseException:
+            self.slot.__exit__(None, None, None)
+            self.stderr_fd.close()
+            raise
+        self.stdout = self.process.stdout
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stdout.close()
+        self.returncode = self.process.wait()
+        self.slot.__exit__(None, None, None)
+        self.stderr_fd.seek(0)
+        command_log = CommandLog(self.command)
+        stderr_tail = OutputTail()
+        _drain_pipe(self.stderr_fd, stderr_tail, command_log)
+        command_log.close()
+        self.stderr = stderr_tail.getvalue()
+        self.stderr_fd.close()
+        return False
+
+class PrefixedStream:
+    '''
+    Read prefix then the rest of stream: used to put back the head of a non seekable stream after looking at it
+    '''
+    def __init__(self, prefix, stream):
+        self.prefix = prefix
+        self.stream = stream
+
+    def read(self, size=-1):
+        if not self.prefix:
+            return self.stream.read(size)
+        if size is None or size < 0:
+            data = self.prefix + self.stream.read()
+            self.prefix = b''
         else:
-            stderr_output = stderr_output.decode()
-        return stdout_output, stderr_output, return_code
+            data = self.prefix[:size]
+            self.prefix = self.prefix[size:]
+        return data
+
+HASH_BUFFER_SIZE = 4 * 1024 * 1024
+# one reusable read buffer per thread
+_hash_buffer = threading.local()
+# thread pool used to hash a file while it is extracted, created on first use
+_hash_executor = None
+_hash_executor_lock = threading.Lock()
+
+class MultiHash:
+    '''
+    hashlib-like object computing several digests (hashlib algorithm names) in a single pass
+    hexdigest() returns the digest of the first algorithm
+    '''
+    def __init__(self, algorithm_list=['md5']):
+        self.hash_dict = {X: hashlib.new(X) for X in algorithm_list}
+        self.algorithm = algorithm_list[0]
+
+    def update(self, data):
+        for file_hash in self.hash_dict.values():
+            file_hash.update(data)
+
+    def hexdigest(self, algorithm=None):
+        return self.hash_dict[algorithm or self.algorithm].hexdigest()
+
+    def hexdigest_dict(self):
+        return {algorithm: file_hash.hexdigest() for algorithm, file_hash in self.hash_dict.items()}
+
+def get_hash_buffer():
+    buffer = getattr(_hash_buffer, 'buffer', None)
+    if buffer is None:
+        buffer = _hash_buffer.buffer = memoryview(bytearray(HASH_BUFFER_SIZE))
+    return buffer
+
+def update_hash(filepath, file_hash):
+    '''
+    feed file_hash (hashlib or MultiHash object) with the content of filepath
+    the file is read into a reusable buffer, hashlib releases the GIL while hashing it
+    '''
+    buffer = get_hash_buffer()
+    with open(filepath, 'rb', buffering=0) as f:
+        while size := f.readinto(buffer):
+            file_hash.update(buffer[:size])
+    return file_hash
+
+def submit_update_hash(filepath, file_hash):
+    '''
+    run update_hash in the hashing thread pool, return a Future
+    '''
+    global _hash_executor
+    with _hash_executor_lock:
+        if _hash_executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+            _hash_executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix='hash')
+    return _hash_executor.submit(update_hash, filepath, file_hash)
+
+def compute_hashes(filepath, algorithm_list=['md5']):
+    '''
+    return a dict algorithm -> hex digest, computed in a single read
+    '''
+    return update_hash(filepath, MultiHash(algorithm_list)).hexdigest_dict()
 
 def compute_md5sum(filepath):
-    with open(filepath, 'rb') as f:
-        file_hash = hashlib.md5()
-        while chunk := f.read(8192):
-            file_hash.update(chunk)
-        return file_hash.hexdigest()
\ No newline at end of file
+    return update_hash(filepath, hashlib.md5()).hexdigest()
+
+# from the fastest to the most portable, a strategy falls back to the next ones when not supported
+COPY_STRATEGY_LIST = ['hardlink', 'reflink', 'copy_file_range', 'sendfile', 'copy']
+# strategies which do not read the data at all: when the file is hashed, the others read it a second time
+SHARED_COPY_STRATEGY_LIST = ['hardlink', 'reflink']
+# linux ioctl cloning a file on copy-on-write filesystems (btrfs, xfs...)
+FICLONE = 0x40049409
+# errors meaning that a strategy is not supported for the given source / destination
+UNSUPPORTED_COPY_ERRNO = {errno.EXDEV, errno.EOPNOTSUPP, errno.ENOTSUP, errno.EINVAL, errno.ENOSYS, errno.ENOTTY, errno.EPERM, errno.EMLINK}
+# (strategy, source device, destination device) known not to work
+UNSUPPORTED_COPY = set()
+
+def _copy_reflink(fsrc, fdst):
+    import fcntl
+    fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+
+def _copy_file_range(fsrc, fdst):
+    while os.copy_file_range(fsrc.fileno(), fdst.fileno(), 1024 * 1024 * 1024):
+        pass
+
+def _copy_sendfile(fsrc, fdst):
+    offset = 0
+    while sent := os.sendfile(fdst.fileno(), fsrc.fileno(), offset, 1024 * 1024 * 1024):
+        offset += sent
+
+def copy_file(src, dst, file_hash=None, strategy='copy'):
+    '''
+    Copy the content of src to dst, feeding file_hash (hashlib object) on the way
+    strategy is one of COPY_STRATEGY_LIST: hardlink, reflink, copy_file_range and sendfile avoid copying the data
+    through userspace and fall back to the next strategies when not supported. With copy, the file is hashed
+    and copied in a single read: if file_hash is set, an unsupported hardlink or reflink falls back to copy directly,
+    copy_file_range and sendfile followed by a hashing pass would read the file twice
+    '''
+    if strategy in COPY_STRATEGY_LIST and strategy != 'copy':
+        device_key = (os.stat(src).st_dev, os.stat(os.path.dirname(dst) or '.').st_dev)
+        for fast_strategy in COPY_STRATEGY_LIST[COPY_STRATEGY_LIST.index(strategy):-1]:
+            if file_hash and fast_strategy != strategy and strategy in SHARED_COPY_STRATEGY_LIST and fast_strategy not in SHARED_COPY_STRATEGY_LIST:
+                break
+            if (fast_strategy, *device_key) in UNSUPPORTED_COPY:
+                continue
+            try:
+                if fast_strategy == 'hardlink':
+                    os.link(src, dst)
+                else:
+                    with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+                        if fast_strategy == 'reflink':
+                            _copy_reflink(fsrc, fdst)
+                        elif fast_strategy == 'copy_file_range':
+                            _copy_file_range(fsrc, fdst)
+                        else:
+                            _copy_sendfile(fsrc, fdst)
+            except (OSError, AttributeError, ImportError) as e:
+                if isinstance(e, OSError) and e.errno not in UNSUPPORTED_COPY_ERRNO:
+                    raise
+                logging.debug(f'Copy strategy {fast_strategy} not supported from {src} to {dst}: {e}')
+                UNSUPPORTED_COPY.add((fast_strategy, *device_key))
+                continue
+            if file_hash:
+                update_hash(src, file_hash)
+            return fast_strategy
+
+    buffer = get_hash_buffer()
+    with open(src, 'rb', buffering=0) as fsrc, open(dst, 'wb') as fdst:
+        while size := fsrc.readinto(buffer):
+            if file_hash:
+                file_hash.update(buffer[:size])
+            fdst.write(buffer[:size])
+    return 'copy'
+
+def make_directories(path):
+    '''
+    os.makedirs(path, exist_ok=True) without recursion, for very deep trees
+    '''
+    missing_list = []
+    while path and not os.path.isdir(path):
+        missing_list.append(path)
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    for path in reversed(missing_list):
+        try:
+            os.mkdir(path)
+        except FileExistsError:
+            if not os.path.isdir(path):
+                raise
+
+def _list_directory(directory, empty_dir_callback=None):
+    try:
+        with os.scandir(directory) as iterator:
+            entry_list = list(iterator)
+    except OSError as e:
+        logging.error(f'Can not list directory {directory}: {e}')
+        return iter(())
+    if not entry_list and empty_dir_callback:
+        empty_dir_callback(directory)
+    return iter(entry_list)
+
+def walk_files(directory, batch_size=64, empty_dir_callback=None):
+    '''
+    walk directory depth first without recursion and yield lists of up to batch_size (path, os.stat_result) for
+    the files found, in the order os.listdir would give them
+    directories, including symbolic links to directories, are walked, anything else is a file
+    the file type comes from the directory listing, so each file is stat'ed once (stat is None if it failed)
+    empty_dir_callback(path) is called for each empty directory
+    '''
+    batch = []
+    stack = [_list_directory(directory, empty_dir_callback)]
+    while stack:
+        entry = next(stack[-1], None)
+        if entry is None:
+            stack.pop()
+            continue
+        try:
+            if entry.is_dir():
+                stack.append(_list_directory(entry.path, empty_dir_callback))
+                continue
+            stat = entry.stat()
+        except OSError:
+            stat = None
+        batch.append((entry.path, stat))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+class SummaryWriter:
+    '''
+    csv writer shared by all workers: rows are serialized so the summary file stays consistent
+    '''
+    def __init__(self, fd, delimiter=','):
+        self.writer = csv.writer(fd, delimiter=delimiter)
+        self.lock = threading.Lock()
+
+    def writerow(self, row, parent=None):
+        '''
+        parent (input path of the archive the file was extracted from) is already part of the input path of the row
+        '''
+        with self.lock:
+            self.writer.writerow(row)
+
+class WorkQueue:
+    '''
+    Thread pool where tasks can submit new tasks. join() waits until every task, including
+    the ones submitted by other tasks, is done and returns the sum of their return values
+    '''
+    def __init__(self, jobs):
+        from concurrent.futures import ThreadPoolExecutor
+        self.executor = ThreadPoolExecutor(max_workers=jobs)
+        self.condition = threading.Condition()
+        self.pending = 0
+        self.error_number = 0
+
+    def submit(self, func, /, *args, **kwargs):
+        with self.condition:
+            self.pending += 1
+        self.executor.submit(self._run, func, args, kwargs)
+
+    def _run(self, func, args, kwargs):
+        error_number = 0
+        try:
+            error_number = func(*args, **kwargs)
+        except Exception:
+            logging.exception(f'Unexpected error in worker while running {func.__name__}')
+            error_number = 1
+        with self.condition:
+            self.error_number += error_number or 0
+            self.pending -= 1
+            if self.pending == 0:
+                self.condition.notify_all()
+
+    def join(self):
+        with self.condition:
+            while self.pending:
+                self.condition.wait()
+            return self.error_number
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)